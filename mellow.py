@@ -1,32 +1,93 @@
-from mellowlexer import Lexer
-from mellowparser import Parser
+import time
+started = time.perf_counter()
+from mellowloader import Loader
 from mellowenv import Environment
+import argparse
 import sys
-import os
 import asyncio
+imported = time.perf_counter()
 
-try:
-    filepath = os.path.realpath(__file__)
-    with open(os.path.join(filepath, sys.argv[1])) as f:
-        text = f.read().encode("unicode_escape").decode("utf-8")
-except Exception as e:
+# `mellow run [-j N] scripts...` runs many scripts on a process pool.
+if sys.argv[1:2] == ['run']:
+    from mellowbatch import main
+    sys.exit(main(sys.argv[2:]))
+
+argparser = argparse.ArgumentParser(prog='mellow')
+argparser.add_argument('file', nargs='?')
+argparser.add_argument('--startup-report', action='store_true',
+                       help='print where cold-start time was spent')
+argparser.add_argument('-O', dest='optimize', type=int, choices=[0, 1], default=1,
+                       help='-O0 runs the tree as parsed, -O1 folds constants first')
+argparser.add_argument('--engine', choices=['vm', 'ast'], default='vm',
+                       help='run compiled code (default), or walk the tree (reference)')
+argparser.add_argument('--no-cache', dest='cache', action='store_false',
+                       help='always lex and parse, ignoring .mlwc files')
+argparser.add_argument('--io-threads', type=int, default=None, metavar='N',
+                       help='threads for file I/O and blocking calls (0 runs them on the loop)')
+argparser.add_argument('--io-stats', action='store_true',
+                       help='print I/O pool queue and completion counts on exit')
+argparser.add_argument('--memo-stats', action='store_true',
+                       help='print cache hits and misses of @mellow.memoize functions on exit')
+argparser.add_argument('--stream', action='store_true',
+                       help='parse and run one top-level statement at a time')
+argparser.add_argument('--serve', action='store_true',
+                       help='keep running and execute scripts sent by mellowclient.py')
+argparser.add_argument('--socket', default=None,
+                       help='Unix socket for --serve (default: $MELLOW_SOCKET, else mellow.sock in $XDG_RUNTIME_DIR or a private per-user temp directory)')
+argparser.add_argument('--profile', action='store_true',
+                       help='time functions, statements and node types and print the hot spots')
+argparser.add_argument('--collapsed', metavar='FILE', default=None,
+                       help='with --profile, write collapsed stacks for flame graph tools')
+options = argparser.parse_args()
+
+if options.serve:
+    from mellowdaemon import Daemon
+    daemon = Daemon(options.socket, options.optimize, options.cache, options.io_threads)
     try:
-        with open("C:/Users/zacha/OneDrive/Documents/Python/Mellow/test.mlw") as f:
-            text = f.read().encode("unicode_escape").decode("utf-8")
-    except Exception as e:
-        if type(e) == IndexError:
-            print("No file passed")
-            sys.exit(2)
-        with open(sys.argv[1]) as f:
-            text = f.read().encode("unicode_escape").decode("utf-8")
+        asyncio.run(daemon.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    sys.exit(0)
+
+if options.file is None:
+    print("No file passed")
+    sys.exit(2)
+
+timings = [('imports', imported - started)] if options.startup_report else None
+loader = Loader(options.optimize, options.cache, timings)
+env = Environment(options.io_threads)
+profiler = None
+if options.profile or options.collapsed:
+    from mellowprofile import Profiler
+    profiler = loader.profiler = Profiler()
 
-env = Environment()
-lexer = Lexer()
-parser = Parser().get_parser()
 async def hello():
-    x = parser.parse(lexer.lex(text), env)
-    return await x.eval(env)
+    if options.stream:
+        return await loader.stream(options.file, env, options.engine)
+    program = loader.load(options.file)
+    return await loader.run(program, env, options.engine)
 
 loop = asyncio.get_event_loop()
-loop.run_until_complete(hello())
-
+if profiler is not None:
+    profiler.install()
+try:
+    loop.run_until_complete(hello())
+finally:
+    env.io.shutdown()
+    if profiler is not None:
+        profiler.uninstall()
+        profiler.report(sys.stderr, options.file)
+        if options.collapsed:
+            profiler.write_collapsed(options.collapsed)
+    if options.io_stats:
+        for name, value in env.io.stats().items():
+            print("io %-10s %6d" % (name, value), file=sys.stderr)
+    if options.memo_stats:
+        for name, memo in env.memos.items():
+            stats = memo.stats()
+            print("memo %-16s " % name + " ".join("%s %d" % item for item in stats.items()), file=sys.stderr)
+    if options.startup_report:
+        total = time.perf_counter() - started
+        for name, seconds in timings:
+            print("%-12s %9.2f ms" % (name, seconds * 1000), file=sys.stderr)
+        print("%-12s %9.2f ms" % ('total', total * 1000), file=sys.stderr)
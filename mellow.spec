@@ -2,12 +2,15 @@
 
 block_cipher = None
 
+# Run `python mellowparser.py` first so the parse tables are frozen into
+# mellowtables/ and shipped with the executable.
+
 
 a = Analysis(['mellow.py'],
              pathex=['C:\\Users\\zacha\\OneDrive\\Documents\\Python\\Mellow'],
              binaries=[],
-             datas=[],
-             hiddenimports=[],
+             datas=[('mellowtables', 'mellowtables')],
+             hiddenimports=['mellowarray'],
              hookspath=[],
              runtime_hooks=[],
              excludes=[],
@@ -0,0 +1,97 @@
+from mellowast import *
+
+# Nodes that may hand control back to the event loop.
+SUSPENDS = (Await, AwaitValue, Gather, Sleep, Blocking, Open, Read)
+
+def mark_sync(program):
+    settle([program], set())
+    return program
+
+def settle(nodes, earlier):
+    # A function is sync when its body is. The first pass assumes every call
+    # is, so recursion does not count against a function; later passes drop
+    # the functions whose body turned out to suspend until nothing changes.
+    # Calls to the functions in `earlier`, defined outside nodes, are sync.
+    # Returns the functions defined in nodes and the names of the sync ones.
+    sync_functions = None
+    while True:
+        marker = SyncMarker(None if sync_functions is None else sync_functions | earlier)
+        for node in nodes:
+            marker.mark(node)
+        found = {name for name, defs in marker.functions.items()
+                 if len(defs) == 1 and defs[0].function.sync}
+        if sync_functions is None:
+            settled = all(call.name in found or call.name in earlier for call in marker.calls)
+        else:
+            settled = found == sync_functions
+        if settled:
+            return marker.functions, found
+        sync_functions = found
+
+# mark_sync for a script run one statement at a time. A call to a function
+# that is not defined yet is taken to suspend. A redefinition re-marks every
+# definition seen so far, since call sites marked against the old body may
+# no longer hold.
+class StreamAnalysis:
+    def __init__(self):
+        # name -> whether the function is sync
+        self.known = {}
+        self.definitions = []
+        # Whether the last statement re-marked the definitions before it.
+        self.remarked = False
+
+    def mark(self, program):
+        earlier = {name for name, sync in self.known.items() if sync}
+        functions, found = settle([program], earlier)
+        self.remarked = any(name in self.known for name in functions)
+        if self.remarked:
+            functions, found = settle(self.definitions + [program], set())
+            self.definitions = []
+        for name, defs in functions.items():
+            self.definitions.extend(defs)
+            self.known[name] = name in found
+        return program
+
+class SyncMarker:
+    def __init__(self, sync_functions):
+        self.sync_functions = sync_functions
+        self.functions = {}
+        self.calls = []
+        self.loops = 0
+
+    def mark_program(self, program):
+        # Also records which top-level statements loop or call a Mellow
+        # function, the ones mellowcompiler compiles.
+        sync = True
+        hot = []
+        for i, statement in enumerate(program.statements):
+            before = len(self.calls) + self.loops
+            if not self.mark(statement):
+                sync = False
+            if len(self.calls) + self.loops != before:
+                hot.append(i)
+        program.hot = tuple(hot)
+        program.sync = sync
+        return sync
+
+    def mark(self, node):
+        if isinstance(node, Program):
+            return self.mark_program(node)
+        if isinstance(node, (While, For)):
+            self.loops += 1
+        sync = True
+        for child in children(node):
+            if not self.mark(child):
+                sync = False
+        if isinstance(node, SUSPENDS) or not hasattr(node, 'eval_sync'):
+            sync = False
+        elif isinstance(node, Function):
+            self.calls.append(node)
+            if self.sync_functions is not None and node.name not in self.sync_functions:
+                sync = False
+        elif isinstance(node, AssignmentFunction):
+            self.functions.setdefault(node.name, []).append(node)
+            # Defining never suspends, whatever the body does when called.
+            sync = True
+        node.sync = sync
+        return sync
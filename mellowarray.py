@@ -0,0 +1,217 @@
+from array import array
+from itertools import repeat
+import operator
+import os
+
+# NumPy is used when it is installed, and only imported once the first
+# array is built, so scripts without arrays start as fast as before.
+# MELLOW_NUMPY=0 keeps to the array module.
+numpy = None
+looked_up = False
+
+def load_numpy():
+    global numpy, looked_up
+    if not looked_up:
+        looked_up = True
+        if os.environ.get('MELLOW_NUMPY') != '0':
+            try:
+                import numpy
+            except ImportError:
+                pass
+    return numpy
+
+NUMBERS = (int, float)
+
+def is_number(value):
+    return isinstance(value, NUMBERS) and not isinstance(value, bool)
+
+def typecode(values):
+    # 'q' (int64) when every element is an int that fits, else 'd' (float64).
+    for value in values:
+        if type(value) is not int or not -2**63 <= value < 2**63:
+            return 'd'
+    return 'q'
+
+# A numeric array: one flat buffer of int64 or float64 values instead of a
+# list of Python objects. The binary-op nodes apply operator.add and
+# friends, which land in the methods below, so v * 2 + w works element by
+# element (a number on either side is applied to every element) without
+# the interpreter looping. Arrays from the array module are worked on with
+# map() over the buffers; NumPy arrays with NumPy's own operations.
+class Vector:
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def elementwise(self, other, op, reflected=False):
+        a = self.data
+        if isinstance(other, Vector):
+            b = other.data
+            if len(a) != len(b):
+                raise ValueError("arrays of different lengths: %d and %d" % (len(a), len(b)))
+        elif is_number(other):
+            b = other
+        elif isinstance(other, (list, tuple)):
+            return self.elementwise(vector(other), op, reflected)
+        else:
+            return NotImplemented
+        if reflected:
+            a, b = b, a
+        if not isinstance(self.data, array):
+            if op is operator.truediv:
+                with numpy.errstate(divide='raise', invalid='raise'):
+                    try:
+                        return Vector(op(a, b))
+                    except FloatingPointError:
+                        raise ZeroDivisionError("division by zero")
+            if integral(a) and integral(b):
+                return Vector(integer_op(op, a, b))
+            return Vector(op(a, b))
+        codes = {getattr(x, 'typecode', 'q' if type(x) is int else 'd') for x in (a, b)}
+        code = 'd' if op is operator.truediv or 'd' in codes else 'q'
+        try:
+            return Vector(array(code, pairs(op, a, b)))
+        except OverflowError:
+            return Vector(array('d', pairs(op, a, b)))
+
+    def __add__(self, other):
+        return self.elementwise(other, operator.add)
+
+    def __radd__(self, other):
+        return self.elementwise(other, operator.add, True)
+
+    def __sub__(self, other):
+        return self.elementwise(other, operator.sub)
+
+    def __rsub__(self, other):
+        return self.elementwise(other, operator.sub, True)
+
+    def __mul__(self, other):
+        return self.elementwise(other, operator.mul)
+
+    def __rmul__(self, other):
+        return self.elementwise(other, operator.mul, True)
+
+    def __truediv__(self, other):
+        return self.elementwise(other, operator.truediv)
+
+    def __rtruediv__(self, other):
+        return self.elementwise(other, operator.truediv, True)
+
+    # Comparing two arrays compares them whole, so they work in conditions.
+    def __eq__(self, other):
+        if isinstance(other, (list, tuple)):
+            other = vector(other)
+        if not isinstance(other, Vector):
+            return NotImplemented
+        return len(self) == len(other) and self.tolist() == other.tolist()
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    # Reductions run over the whole buffer at once.
+    def sum(self):
+        return scalar(self.data.sum() if not isinstance(self.data, array) else sum(self.data))
+
+    def min(self):
+        if not len(self.data):
+            raise ValueError("min() of an empty array")
+        return scalar(self.data.min() if not isinstance(self.data, array) else min(self.data))
+
+    def max(self):
+        if not len(self.data):
+            raise ValueError("max() of an empty array")
+        return scalar(self.data.max() if not isinstance(self.data, array) else max(self.data))
+
+    def mean(self):
+        if not len(self.data):
+            raise ValueError("mean() of an empty array")
+        return self.sum() / len(self.data)
+
+    def dot(self, other):
+        return (self * other).sum()
+
+    def size(self):
+        return len(self.data)
+
+    def tolist(self):
+        return self.data.tolist()
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def __getitem__(self, index):
+        return scalar(self.data[index])
+
+    def __repr__(self):
+        return repr(self.tolist())
+
+def pairs(op, a, b):
+    if not isinstance(a, array):
+        return map(op, repeat(a), b)
+    if not isinstance(b, array):
+        return map(op, a, repeat(b))
+    return map(op, a, b)
+
+def integral(value):
+    return type(value) is int or getattr(value, 'dtype', None) is not None and value.dtype.kind == 'i'
+
+def integer_op(op, a, b):
+    # NumPy's int64 arithmetic wraps around where the array module's raises
+    # OverflowError. A float64 estimate tells whether any element could;
+    # if so the elements are worked out as Python ints and, like the array
+    # module's, kept as float64 when they do not fit in int64.
+    f = numpy.float64
+    estimate = op(numpy.asarray(a, dtype=f), numpy.asarray(b, dtype=f))
+    if not estimate.size or numpy.abs(estimate).max() < 2**62:
+        try:
+            return op(a, b)
+        except OverflowError:
+            # A Python int operand too big for int64.
+            pass
+    return vector(op(numpy.asarray(a, dtype=object), numpy.asarray(b, dtype=object)).tolist()).data
+
+def scalar(value):
+    # NumPy scalars back to plain ints and floats.
+    return value.item() if hasattr(value, 'item') else value
+
+def vector(values):
+    if isinstance(values, Vector):
+        return values
+    if not isinstance(values, (list, tuple)):
+        values = list(values)
+    for value in values:
+        if not is_number(value):
+            raise TypeError("arrays hold numbers, not " + type(value).__name__)
+    code = typecode(values)
+    np = load_numpy()
+    if np is not None:
+        return Vector(np.array(values, dtype=np.int64 if code == 'q' else np.float64))
+    return Vector(array(code, values))
+
+def zeros(n):
+    np = load_numpy()
+    if np is not None:
+        return Vector(np.zeros(n, dtype=np.int64))
+    return Vector(array('q', bytes(8 * n)))
+
+def arange(start, stop=None, step=1):
+    if stop is None:
+        start, stop = 0, start
+    if all(type(x) is int for x in (start, stop, step)):
+        np = load_numpy()
+        if np is not None:
+            return Vector(np.arange(start, stop, step, dtype=np.int64))
+        return Vector(array('q', range(start, stop, step)))
+    np = load_numpy()
+    if np is not None:
+        return Vector(np.arange(start, stop, step, dtype=np.float64))
+    count = max(0, -int(-(stop - start) // step))
+    return Vector(array('d', (start + i * step for i in range(count))))
@@ -1,178 +1,434 @@
-from rply.token import BaseBox
-import time
-import importlib
-import inspect
+from mellowenv import UNDEFINED
+from mellowio import File, Lines, slurp
+from mellowimport import import_module, import_from
+from mellowmemo import Memo, MISSING
+import functools
+import operator
+import asyncio
+
+# Not an rply BaseBox: the parser does not need one, and loading a cached
+# tree then does not import rply at all.
+#
+# Nodes keep their attributes in __slots__, declared by every subclass
+# (with () when it adds none), never in a __dict__. Attributes the passes
+# fill in later start out in __init__, since a slot cannot also have a
+# class-level default. A node itself takes 64 to 120 bytes, most 64 to 80;
+# the target for a prepared tree, counting the lists, names and constants
+# the nodes keep alive, is NODE_BYTES per node on average over the
+# benchmark corpus, as measured by `mellowbench.py memory`.
+NODE_BYTES = 128
+
+class Node:
+    # sync is set by mellowanalysis.mark_sync on subtrees that can never
+    # suspend; those are run through eval_sync instead of the eval
+    # coroutine. lineno and colno are the position of the node's first
+    # token, set by the parser.
+    __slots__ = ('sync', 'lineno', 'colno')
+    # Attributes holding child nodes, in evaluation order.
+    fields = ()
+
+    def __new__(cls, *args, **kwargs):
+        node = object.__new__(cls)
+        node.sync = False
+        node.lineno = node.colno = 0
+        return node
+
+def children(node):
+    for field in node.fields:
+        value = getattr(node, field)
+        if value is None or isinstance(value, (str, int)):
+            continue
+        if isinstance(value, dict):
+            for k, v in value.items():
+                if isinstance(k, Node):
+                    yield k
+                yield v
+        elif isinstance(value, list):
+            yield from value
+        else:
+            yield value
+
+class FunctionReturn(Exception):
+    # Raised by a return that is not the last thing its function evaluates.
+    def __init__(self, value):
+        self.value = value
+
+def bound(variable, env):
+    # Value of a resolved receiver name, or UNDEFINED when the name is not
+    # a variable (and so may be an import).
+    if variable is None:
+        return UNDEFINED
+    return variable.lookup(env)
+
+def undefined(env, name):
+    # A variable never assigned may name an import used as a value, as in
+    # `from math import pi`; otherwise it really is undefined.
+    namespace = env.imports.get(name)
+    if namespace is None:
+        raise NameError(name + " is not yet defined")
+    return namespace.resolve()
+
+# What an inline cache holds before its first lookup.
+NO_IC = (UNDEFINED, None)
+
+def imported(env, module, name):
+    namespace = env.imports.get(module)
+    if namespace is None:
+        return None
+    return namespace.get(name)
 
+class Number(Node):
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = int(value)
+
+    async def eval(self, env):
+        return self.value
+
+    def eval_sync(self, env):
+        return self.value
+
+class Constant(Node):
+    # A value computed ahead of time, e.g. by mellowoptimizer.
+    __slots__ = ('value',)
 
-class Number(BaseBox):
     def __init__(self, value):
         self.value = value
 
     async def eval(self, env):
-        return int(self.value)
+        return self.value
+
+    def eval_sync(self, env):
+        return self.value
+
+class Boolean(Node):
+    __slots__ = ('value',)
 
-class Boolean(BaseBox):
     def __init__(self, value):
         self.value = bool(value)
 
     async def eval(self, env):
         return self.value
 
-class BinaryOp(BaseBox):
+    def eval_sync(self, env):
+        return self.value
+
+class BinaryOp(Node):
+    __slots__ = fields = ('left', 'right')
+
     def __init__(self, left, right):
         self.left = left
         self.right = right
 
+    async def eval(self, env):
+        left = self.left.eval_sync(env) if self.left.sync else await self.left.eval(env)
+        right = self.right.eval_sync(env) if self.right.sync else await self.right.eval(env)
+        return self.apply(left, right)
+
+    def eval_sync(self, env):
+        return self.apply(self.left.eval_sync(env), self.right.eval_sync(env))
+
 
 class Sum(BinaryOp):
-    async def eval(self, env):
-        return await self.left.eval(env) + await self.right.eval(env)
+    __slots__ = ()
+    apply = staticmethod(operator.add)
 
 class Sub(BinaryOp):
-    async def eval(self, env):
-        return await self.left.eval(env) - await self.right.eval(env)
+    __slots__ = ()
+    apply = staticmethod(operator.sub)
 
 class Mul(BinaryOp):
-    async def eval(self, env):
-        return await self.left.eval(env) * await self.right.eval(env)
+    __slots__ = ()
+    apply = staticmethod(operator.mul)
 
 class Div(BinaryOp):
-    async def eval(self, env):
-        return await self.left.eval(env) / await self.right.eval(env)
+    __slots__ = ()
+    apply = staticmethod(operator.truediv)
+
+class Print(Node):
+    __slots__ = fields = ('value',)
 
-class Print:
     def __init__(self, value):
         self.value = value
 
     async def eval(self, env):
-        x = await self.value.eval(env)
+        x = self.value.eval_sync(env) if self.value.sync else await self.value.eval(env)
         print(x)
 
-class String(BaseBox):
+    def eval_sync(self, env):
+        print(self.value.eval_sync(env))
+
+class String(Node):
+    __slots__ = ('value',)
+
     def __init__(self, value):
         self.value = value.strip('"\'')
 
     async def eval(self, env):
         return self.value
 
-class Variable(BaseBox):
+    def eval_sync(self, env):
+        return self.value
+
+class Variable(Node):
+    __slots__ = ('name', 'depth', 'slot')
+
     def __init__(self, name):
         self.name = str(name)
-        self.value = None
+        # Frame coordinate assigned by mellowresolver.Resolver.
+        self.depth = 0
+        self.slot = None
+
+    def lookup(self, env):
+        return (env.locals if self.depth == 0 else env.globals)[self.slot]
+
+    def store(self, env, value):
+        (env.locals if self.depth == 0 else env.globals)[self.slot] = value
 
     async def eval(self, env):
-        kwargs = dict()
-        for i in range(len(env.args[1])):
-            kwargs.update({env.args[0][i]:env.args[1][i]})
-        if env.variables.get(self.name):
-            self.value = env.variables[self.name]
-            return self.value
-        elif env.arguments.get(self.name):
-            self.value = await env.arguments[self.name].eval(env)
-            return self.value
-        elif kwargs.get(self.name):
-            self.value = await kwargs[self.name].eval(env)
-            return self.value
-        raise NameError("Not yet defined")
+        return self.eval_sync(env)
+
+    def eval_sync(self, env):
+        value = (env.locals if self.depth == 0 else env.globals)[self.slot]
+        if value is UNDEFINED:
+            value = undefined(env, self.name)
+            self.store(env, value)
+        return value
 
 class Assignment(BinaryOp):
+    __slots__ = ()
+
     async def eval(self, env):
-        if isinstance(self.left,Variable):
-            if not env.variables.get(self.left.name):
-                env.variables[self.left.name] = await self.right.eval(env)
-                return self.right
+        if self.right.sync:
+            self.left.store(env, self.right.eval_sync(env))
         else:
-            raise NameError("Cannot assign to this")
+            self.left.store(env, await self.right.eval(env))
+
+    def eval_sync(self, env):
+        self.left.store(env, self.right.eval_sync(env))
+
+class Program(Node):
+    __slots__ = ('statements', 'global_names', 'hot')
+    fields = ('statements',)
 
-class Program(BaseBox): 
     def __init__(self, statement):
         self.statements = []
         self.statements.append(statement)
-        self.run = False
+        # Names of the global slots, in order, set by the resolver.
+        self.global_names = None
+        # Indexes of the statements that loop or call a Mellow function, set
+        # by mellowanalysis.
+        self.hot = ()
     
     def add_statement(self, statement):
-        self.statements.insert(0,statement)
+        self.statements.append(statement)
         
     async def eval(self, env):
         result = None
-        for statement in self.statements:
-            result = await statement.eval(env)
+        try:
+            for statement in self.statements:
+                if statement.sync:
+                    result = statement.eval_sync(env)
+                else:
+                    result = await statement.eval(env)
+        except FunctionReturn as r:
+            return r.value
+        return result
+
+    def eval_sync(self, env):
+        result = None
+        try:
+            for statement in self.statements:
+                result = statement.eval_sync(env)
+        except FunctionReturn as r:
+            return r.value
         return result
     
     def get_statements(self):
         return self.statements
     
-class If(BaseBox):
+class If(Node):
+    __slots__ = fields = ('condition', 'body', 'elif_condition', 'elif_body', 'else_body')
+
     def __init__(self, *, condition, body, else_body=None, elif_condition=None, elif_body=None):
         self.condition = condition
         self.body = body
         self.else_body = else_body
         self.elif_condition = elif_condition
         self.elif_body = elif_body
-        
+
     async def eval(self, env): 
-        if await self.condition.eval(env): 
-            return await self.body.eval(env)
-        elif self.elif_condition and self.elif_body and self.else_body:
-            if await self.elif_condition.eval(env):
-                return await self.elif_body.eval(env)
+        if self.condition.eval_sync(env) if self.condition.sync else await self.condition.eval(env):
+            body = self.body
+        elif self.elif_condition and self.elif_body:
+            if self.elif_condition.sync:
+                condition = self.elif_condition.eval_sync(env)
             else:
-                if self.else_body:
-                    return await self.else_body.eval(env)
+                condition = await self.elif_condition.eval(env)
+            body = self.elif_body if condition else self.else_body
+        else:
+            body = self.else_body
+        if body is None:
+            return None
+        return body.eval_sync(env) if body.sync else await body.eval(env)
+
+    def eval_sync(self, env):
+        if self.condition.eval_sync(env):
+            body = self.body
         elif self.elif_condition and self.elif_body:
-            if await self.elif_condition.eval(env):
-                return await self.elif_body.eval(env)
+            body = self.elif_body if self.elif_condition.eval_sync(env) else self.else_body
         else:
-            if self.else_body:
-                return self.else_body.eval(env)
-        return None
+            body = self.else_body
+        if body is None:
+            return None
+        return body.eval_sync(env)
+
+# Loops run every pass inside the one eval call, in the frame they appear
+# in. A body that cannot suspend goes through eval_sync, so a pass creates
+# no coroutine, and deep iteration never nests Python calls the way
+# recursion through Function does. A loop's value is None.
+class While(Node):
+    __slots__ = fields = ('condition', 'body')
+
+    def __init__(self, condition, body):
+        self.condition = condition
+        self.body = body
 
-class Equal(BinaryOp):
     async def eval(self, env):
-        return await self.left.eval(env) == await self.right.eval(env)
+        condition = self.condition
+        body = self.body
+        while condition.eval_sync(env) if condition.sync else await condition.eval(env):
+            if body.sync:
+                body.eval_sync(env)
+            else:
+                await body.eval(env)
+
+    def eval_sync(self, env):
+        condition = self.condition
+        body = self.body
+        while condition.eval_sync(env):
+            body.eval_sync(env)
+
+class For(Node):
+    # for name in value: anything Python can iterate, such as a range, an
+    # array, a list, a dict's keys or an open file, which gives its lines
+    # without their newlines. A file's lines are read on the I/O pool a
+    # batch at a time (see mellowio.Lines), except in a loop that never
+    # suspends, run through eval_sync, where they are read on the loop's
+    # thread as they are needed.
+    __slots__ = fields = ('target', 'iterable', 'body')
+
+    def __init__(self, target, iterable, body):
+        self.target = target
+        self.iterable = iterable
+        self.body = body
 
-class NotEqual(BinaryOp):
     async def eval(self, env):
-        return await self.left.eval(env) != await self.right.eval(env)
+        iterable = self.iterable
+        values = iterable.eval_sync(env) if iterable.sync else await iterable.eval(env)
+        if type(values) is File:
+            lines = Lines(values)
+            while await lines.refill(env.root.io):
+                await self.loop(lines, env)
+        else:
+            await self.loop(values, env)
+
+    async def loop(self, values, env):
+        target = self.target
+        slots = env.locals if target.depth == 0 else env.globals
+        slot = target.slot
+        body = self.body
+        if body.sync:
+            for slots[slot] in values:
+                body.eval_sync(env)
+        else:
+            for slots[slot] in values:
+                await body.eval(env)
+
+    def eval_sync(self, env):
+        target = self.target
+        slots = env.locals if target.depth == 0 else env.globals
+        slot = target.slot
+        body = self.body
+        for slots[slot] in self.iterable.eval_sync(env):
+            body.eval_sync(env)
+
+class Equal(BinaryOp):
+    __slots__ = ()
+    apply = staticmethod(operator.eq)
+
+class NotEqual(BinaryOp):
+    __slots__ = ()
+    apply = staticmethod(operator.ne)
         
 class GreaterThan(BinaryOp):
-    async def eval(self, env):
-        return await self.left.eval(env) > await self.right.eval(env)
+    __slots__ = ()
+    apply = staticmethod(operator.gt)
 
 class LessThan(BinaryOp):
-    async def eval(self, env):
-        return await self.left.eval(env) < await self.right.eval(env)
+    __slots__ = ()
+    apply = staticmethod(operator.lt)
 
 class GreaterThanEqual(BinaryOp):
-    async def eval(self, env):
-        return await self.left.eval(env) >= await self.right.eval(env)
+    __slots__ = ()
+    apply = staticmethod(operator.ge)
 
 class LessThanEqual(BinaryOp):
-    async def eval(self, env):
-        return await  self.left.eval(env) <= await self.right.eval(env)
+    __slots__ = ()
+    apply = staticmethod(operator.le)
+
+class Function(Node):
+    __slots__ = ('name', 'args')
+    fields = ('args',)
 
-class Function(BaseBox):
     def __init__(self, name, args=None):
         self.name = name
-        self.value = None
         self.args = args
 
-    async def eval(self, env):
-        if env.functions.get(self.name):
-            needed = env.functions[self.name][1]
-            have = self.args.statements if self.args else []
-            env.arguments = dict()
-            for i in range(len(needed)):
-                try:
-                    env.arguments.update({needed[i].name:have[i]})
-                except IndexError:
-                    raise TypeError(self.name + "() missing required arguments.")
-            self.value = await env.functions[self.name][0].eval(env)
-            env.arguments = dict()
-            return self.value
-        raise NameError("Not yet defined")
-
-class AssignmentFunction:
+    def enter(self, env, args):
+        function = env.functions.get(self.name)
+        if function is None:
+            raise NameError(self.name + " is not yet defined")
+        params = len(function.args or [])
+        if len(args) < params:
+            raise TypeError(self.name + "() missing required arguments.")
+        frame = env.new_frame(function.nlocals)
+        frame.locals[:params] = args[:params]
+        return function.function, frame
+
+    async def eval(self, env):
+        args = []
+        if self.args:
+            for arg in self.args.statements:
+                args.append(arg.eval_sync(env) if arg.sync else await arg.eval(env))
+        body, frame = self.enter(env, args)
+        try:
+            return body.eval_sync(frame) if body.sync else await body.eval(frame)
+        except FunctionReturn as r:
+            return r.value
+        finally:
+            env.release(frame)
+
+    def eval_sync(self, env):
+        args = [arg.eval_sync(env) for arg in self.args.statements] if self.args else []
+        body, frame = self.enter(env, args)
+        try:
+            return body.eval_sync(frame)
+        except FunctionReturn as r:
+            return r.value
+        finally:
+            env.release(frame)
+
+def compile_on_call(function, env, *args):
+    from mellowcompiler import Compiler
+    Compiler().compile_function(function)
+    return function.code(env, *args)
+
+class AssignmentFunction(Node):
+    __slots__ = ('name', 'function', 'args', 'nlocals', 'code')
+    fields = ('function',)
+
     def __init__(self, name, function, args):
         self.name = name
         self.function = function
@@ -180,53 +436,78 @@ class AssignmentFunction:
             self.args = args.statements
         else:
             self.args = None
+        # Frame size, set by the resolver: parameters first, then locals.
+        self.nlocals = 0
+        # The Python function mellowcompiler turns the function into, called
+        # as code(env, *args); a stub that compiles it until the first call.
+        self.code = functools.partial(compile_on_call, self)
 
     async def eval(self, env):
-        env.functions[self.name] = [self.function, self.args]
+        env.functions[self.name] = self
         return self.name
 
-class InnerArray(BaseBox):
+    def eval_sync(self, env):
+        env.functions[self.name] = self
+        return self.name
+
+class InnerArray(Node):
+    __slots__ = fields = ('statements',)
+
     def __init__(self, statements = None):
         self.statements = []
-        self.values = []
         if statements:
             self.statements = statements
 
     def append(self, statement):
         self.statements.append(statement)
 
+    def prepend(self, statement):
+        self.statements.insert(0, statement)
+
+
+class Array(Node):
+    __slots__ = ('statements', 'template')
+    fields = ('statements',)
 
-class Array(BaseBox):
     def __init__(self, inner):
         self.statements = inner.statements
-        self.values = []
+        # Set by the optimizer when every element is a literal: their values,
+        # as a tuple each evaluation builds a new list from.
+        self.template = None
     
     def __len__(self):
         return len(self.statements)
 
     def append(self, statement):
         self.statements.append(statement)
-    
-    def index(self, i):
-        if type(i) is Number:
-            return self.values[i.value]
-        raise IndexError("Cannot index with that value")
 
     async def eval(self, env):
-        
-        if len(self.values) == 0:            
-            for statement in self.statements:
-                self.values.append(await statement.eval(env))
-        return self
+        if self.template is not None:
+            return list(self.template)
+        values = []
+        for statement in self.statements:
+            values.append(statement.eval_sync(env) if statement.sync else await statement.eval(env))
+        return values
+
+    def eval_sync(self, env):
+        if self.template is not None:
+            return list(self.template)
+        return [statement.eval_sync(env) for statement in self.statements]
+
+class Arguments(Array):
+    # The argument list of a call. Evaluated argument by argument by the
+    # call itself, and never folded into a constant like an array literal.
+    __slots__ = ()
+
+class Block(Node):
+    __slots__ = fields = ('statements',)
 
-class Block(BaseBox):
-    
     def __init__(self, statement):
         self.statements = []
         self.statements.append(statement)
     
     def add_statement(self, statement):
-        self.statements.insert(0,statement)
+        self.statements.append(statement)
     
     def get_statements(self):
         return self.statements
@@ -234,73 +515,97 @@ class Block(BaseBox):
     async def eval(self, env):
         result = None
         for statement in self.statements:
-            result = await statement.eval(env)
+            if statement.sync:
+                result = statement.eval_sync(env)
+            else:
+                result = await statement.eval(env)
         return result
 
-class Sleep:
+    def eval_sync(self, env):
+        result = None
+        for statement in self.statements:
+            result = statement.eval_sync(env)
+        return result
+
+class Sleep(Node):
+    __slots__ = fields = ('time',)
+
     def __init__(self, time):
         self.time = time
     
     async def eval(self, env):
-        time.sleep(self.time)
+        # Yields to the loop so spawned tasks and callbacks keep running.
+        seconds = self.time.eval_sync(env) if self.time.sync else await self.time.eval(env)
+        await asyncio.sleep(seconds)
+
+class Open(Node):
+    __slots__ = ('path',)
 
-class Open:
     def __init__(self, filepath):
-        self.filepath = filepath
+        self.path = filepath.strip("'\"")
     
     async def eval(self, env):
-        return open(self.filepath.strip("'\""))
+        return await env.root.io.run(File, env.root.resolve_path(self.path), env.root.files)
+
+class Read(Node):
+    __slots__ = fields = ('file',)
 
-class Read:
     def __init__(self, file):
         self.file = file
-        self.value = None
     
     async def eval(self, env):
-        if self.value:
-            return self.value
-        elif isinstance(self.file, Open):
-            x = await self.file.eval(env)
-            self.value = x.read()
-            return self.value
-        elif isinstance(self.file, Variable):
-            x = await self.file.eval(env)
-            self.value = x.read()
-            return self.value
-        else:
-            self.value = self.file.read()
-            return self.value
+        io = env.root.io
+        if isinstance(self.file, Open):
+            # open("x").read(): nothing else can reach the file, so it is
+            # opened, read and closed in one trip to the pool.
+            return await io.run(slurp, env.root.resolve_path(self.file.path))
+        f = self.file.eval_sync(env) if self.file.sync else await self.file.eval(env)
+        return await io.run(f.read)
+
+class Return(Node):
+    __slots__ = ('exp', 'tail')
+    fields = ('exp',)
 
-class Return:
     def __init__(self, expression):
         self.exp = expression
+        # Set by the resolver when the value already falls out of the
+        # function as its result, so no unwinding is needed.
+        self.tail = False
     
     async def eval(self, env):
-        return await self.exp.eval(env)
+        value = self.exp.eval_sync(env) if self.exp.sync else await self.exp.eval(env)
+        if self.tail:
+            return value
+        raise FunctionReturn(value)
+
+    def eval_sync(self, env):
+        value = self.exp.eval_sync(env)
+        if self.tail:
+            return value
+        raise FunctionReturn(value)
+
+class Import(Node):
+    __slots__ = ('name', 'module')
 
-class Import:
     def __init__(self, name, module):
         self.name = name
         self.module = module
     
     async def eval(self, env):
+        return self.eval_sync(env)
+
+    def eval_sync(self, env):
         if self.module:
-            name = "." + self.name
-            imported = importlib.import_module(name, self.module)
-            env.imports.update({self.name: dict()})
-            for m in dir(imported):
-                f = getattr(imported, m)
-                env.imports[self.name].update({m : f})
-            return imported 
+            namespace = import_from(self.module, self.name)
         else:
-            imported = importlib.import_module(self.name)
-            env.imports.update({self.name: dict()})
-            for m in dir(imported):
-                f = getattr(imported, m)
-                env.imports[self.name].update({m : f})
-            return imported
-
-class ImportedFunction:
+            namespace = import_module(self.name)
+        env.imports[self.name] = namespace
+        return namespace
+
+class ImportedFunction(Node):
+    __slots__ = ('name', 'module', 'function', 'args', 'kwargs', 'target', 'ic', 'plan')
+    fields = ('args', 'kwargs')
+
     def __init__(self, module, function, args=None, kwargs = None):
         self.name = function
         self.module = module
@@ -310,102 +615,150 @@ class ImportedFunction:
         else:
             self.args = None
         if kwargs:
-            self.kwargs = kwargs.statements
+            self.kwargs = kwargs.data
         else:
             self.kwargs = None
+        # Resolved Variable for the receiver when it names a variable.
+        self.target = None
+        # Inline cache for imported names: the namespace and the callable
+        # found in it. Methods of variables are looked up on every call.
+        self.ic = NO_IC
+        # Argument nodes and keyword names, fixed on the first call.
+        self.plan = None
+
+    def callee(self, env):
+        receiver = bound(self.target, env)
+        if receiver is UNDEFINED:
+            return self.lookup(env)
+        # Not cached: the attribute can be reassigned on the same object.
+        return getattr(receiver, self.function)
+
+    def lookup(self, env):
+        # The function in the imported namespace, through the inline cache.
+        receiver = env.imports.get(self.module)
+        if receiver is None:
+            raise NameError("Not yet Defined")
+        if receiver is self.ic[0]:
+            return self.ic[1]
+        f = receiver.get(self.function)
+        if f is None:
+            raise NameError("Not yet Defined")
+        self.ic = (receiver, f)
+        return f
+
+    def make_plan(self):
+        # Built after the optimizer has rewritten the argument nodes.
+        kwargs = self.kwargs or {}
+        self.plan = (tuple(self.args or ()), tuple(kwargs), tuple(kwargs.values()))
+        return self.plan
+
+    async def arguments(self, env):
+        positional, names, values = self.plan or self.make_plan()
+        args = []
+        for arg in positional:
+            args.append(arg.eval_sync(env) if arg.sync else await arg.eval(env))
+        kwargs = []
+        for value in values:
+            kwargs.append(value.eval_sync(env) if value.sync else await value.eval(env))
+        return args, dict(zip(names, kwargs))
+
     
     async def eval(self, env):
-        if env.variables.get(self.module):
-            m = env.variables[self.module]
-            if getattr(m, self.function):
-                f = getattr(m,self.function)
-                if self.args and self.kwargs:
-                    kwargs = {}
-                    for k in self.kwargs:
-                        kwargs.update({k : await self.kwargs[k].eval(env)})
-                    args = [await arg.eval(env) for arg in self.args]
-                    return f(*args, **kwargs)
-                elif self.args and not self.kwargs:
-                    args = [await arg.eval(env) for arg in self.args]
-                    return f(*args)
-                elif not self.args and self.kwargs:
-                    kwargs = {}
-                    for k in self.kwargs:
-                        kwargs.update({k : await self.kwargs[k].eval(env)})
-                    return f(**kwargs)
-                else:
-                    return f()
-        elif env.imports.get(self.module):
-            m = env.imports[self.module]
-            if m.get(self.function):
-                f = m[self.function]
-                if self.args and self.kwargs:
-                    kwargs = {}
-                    for k in self.kwargs:
-                        kwargs.update({k : await self.kwargs[k].eval(env)})
-                    args = [await arg.eval(env) for arg in self.args]
-                    return f(*args, **kwargs)
-                elif self.args and not self.kwargs:
-                    args = [await arg.eval(env) for arg in self.args]
-                    return f(*args)
-                elif not self.args and self.kwargs:
-                    kwargs = {}
-                    for k in self.kwargs:
-                        kwargs.update({k : await self.kwargs[k].eval(env)})
-                    return f(**kwargs)
-                else:
-                    return f()
-        raise NameError("Not yet Defined")
+        f = self.callee(env)
+        args, kwargs = await self.arguments(env)
+        return f(*args, **kwargs)
+
+    def eval_sync(self, env):
+        f = self.callee(env)
+        positional, names, values = self.plan or self.make_plan()
+        args = [arg.eval_sync(env) for arg in positional]
+        if names:
+            return f(*args, **dict(zip(names, [value.eval_sync(env) for value in values])))
+        return f(*args)
+
+class InnerDict(Node):
+    __slots__ = ('data',)
 
-class InnerDict(BaseBox):
     def __init__(self, statements = None):
         self.data = {}
-        self.values = {}
-        self.statements = {}
         if statements:
-            self.statements = statements
             self.data = statements
 
     def update(self, key, val):
         self.data[key] = val
 
-class Dict(BaseBox):
+class Dict(Node):
+    __slots__ = ('data', 'keys', 'template')
+    fields = ('data',)
+
     def __init__(self, inner):
         self.data = inner.data
-        self.statements = inner.statements
-        self.values = list()
+        # Set by the optimizer when every key is a constant: the keys in
+        # order, and a dict of them (all None) that each evaluation copies,
+        # so the new dict is built at its final size. When the values are
+        # constants too, the template holds them and there are no keys left
+        # to fill in.
+        self.keys = None
+        self.template = None
     
     def update(self, key, val):
         self.data[key] = val
     
     async def eval(self, env):
-        if len(self.values) == 0:            
-            for statement in self.statements:
-                self.values.append(await statement.eval(env))
-        data = {}
-        for k in self.data:
-            data.update({await k.eval(env) : await self.data[k].eval(env)})
+        if self.template is None:
+            data = {}
+            for k, v in self.data.items():
+                key = k.eval_sync(env) if k.sync else await k.eval(env)
+                data[key] = v.eval_sync(env) if v.sync else await v.eval(env)
+            return data
+        data = self.template.copy()
+        for key, v in zip(self.keys, self.data.values()):
+            data[key] = v.eval_sync(env) if v.sync else await v.eval(env)
         return data
 
-class GetAttr:
+    def eval_sync(self, env):
+        if self.template is None:
+            return {k.eval_sync(env): v.eval_sync(env) for k, v in self.data.items()}
+        data = self.template.copy()
+        for key, v in zip(self.keys, self.data.values()):
+            data[key] = v.eval_sync(env)
+        return data
+
+class GetAttr(Node):
+    __slots__ = ('left', 'right', 'target', 'ic')
+
     def __init__(self, left, right):
         self.left = left
         self.right = right
+        self.target = None
+        # Inline cache for imported names: the namespace and the value
+        # found. Attributes of variables can change at any time and are
+        # not cached.
+        self.ic = NO_IC
     
     async def eval(self, env):
-        if not isinstance(self.left, Variable):
-            if env.variables.get(self.left):
-                return getattr(env.variables.get(self.left), self.right)
-            elif env.imports.get(self.left):
-                return env.imports.get(self.left).get(self.right)
-        else:
-            if env.variables.get(await self.left.eval(env)):
-                return env.imports.get(await self.left.eval(env)).get(self.right)
-            elif env.variables.get(await self.left.eval(env)):
-                return getattr(env.variables.get(await self.left.eval(env)), self.right)
-        raise AttributeError(str(type(self.left)) + " has no attribute " + self.right)
+        return self.eval_sync(env)
+
+    def eval_sync(self, env):
+        value = bound(self.target, env)
+        if value is not UNDEFINED:
+            return getattr(value, self.right)
+        return self.lookup(env)
+
+    def lookup(self, env):
+        namespace = env.imports.get(self.left)
+        if namespace is None:
+            raise AttributeError(str(self.left) + " has no attribute " + self.right)
+        if namespace is self.ic[0]:
+            return self.ic[1]
+        value = namespace.get(self.right)
+        self.ic = (namespace, value)
+        return value
+
+class Await(Node):
+    __slots__ = ('args', 'kwargs', 'module', 'function', 'target', 'ic', 'plan')
+    fields = ('args', 'kwargs')
 
-class Await(BaseBox):
     def __init__(self, function):
         if isinstance(function, Function):
             raise TypeError("Non async functions can't be used in await expressions")
@@ -413,53 +766,110 @@ class Await(BaseBox):
         self.module = function.module
         self.args = function.args
         self.function = function.function
-
-    async def eval(self, env):
-        if env.imports.get(self.module):
-            m = env.imports[self.module]
-            if m.get(self.function):
-                f = m[self.function]
-                if self.args and self.kwargs:
-                    kwargs = {}
-                    for k in self.kwargs:
-                        kwargs.update({k : await self.kwargs[k].eval(env)})
-                    args = [await arg.eval(env) for arg in self.args]
-                    return await f(*args, **kwargs)
-                elif self.args and not self.kwargs:
-                    args = [await arg.eval(env) for arg in self.args]
-                    return await f(*args)
-                elif not self.args and self.kwargs:
-                    kwargs = {}
-                    for k in self.kwargs:
-                        kwargs.update({k : await self.kwargs[k].eval(env)})
-                    return await f(**kwargs)
-                else:
-                    return await f()
-        elif env.variables.get(self.module):
-            v = env.variables[self.module]
+        self.target = None
+        self.ic = NO_IC
+        self.plan = None
+
+    def callee(self, env):
+        # Imports win over variables here, unlike ImportedFunction.
+        receiver = env.imports.get(self.module)
+        if receiver is not None:
+            if receiver is self.ic[0]:
+                return self.ic[1]
+            f = receiver.get(self.function)
+            if f is not None:
+                self.ic = (receiver, f)
+                return f
+        receiver = bound(self.target, env)
+        if receiver is not UNDEFINED:
             try:
-                f = getattr(v, self.function)
-                if self.args and self.kwargs:
-                    kwargs = {}
-                    for k in self.kwargs:
-                        kwargs.update({k : await self.kwargs[k].eval(env)})
-                    args = [await arg.eval(env) for arg in self.args]
-                    return await f(*args, **kwargs)
-                elif self.args and not self.kwargs:
-                    args = [await arg.eval(env) for arg in self.args]
-                    return await f(*args)
-                elif not self.args and self.kwargs:
-                    kwargs = {}
-                    for k in self.kwargs:
-                        kwargs.update({k : await self.kwargs[k].eval(env)})
-                    return await f(**kwargs)
-                else:
-                    return await f()
+                return getattr(receiver, self.function)
             except AttributeError:
                 raise NameError("This variable does not have that function")
         raise NameError("Not yet Defined")
-        
-class DecoratedFunction:
+
+    make_plan = ImportedFunction.make_plan
+    arguments = ImportedFunction.arguments
+
+    async def eval(self, env):
+        f = self.callee(env)
+        args, kwargs = await self.arguments(env)
+        return await f(*args, **kwargs)
+
+async def run_body(body, frame, env):
+    try:
+        return body.eval_sync(frame) if body.sync else await body.eval(frame)
+    except FunctionReturn as r:
+        return r.value
+    finally:
+        env.release(frame)
+
+class Spawn(Node):
+    __slots__ = fields = ('call',)
+
+    def __init__(self, call):
+        self.call = call
+
+    async def eval(self, env):
+        # Arguments are evaluated now, in order; only the call itself runs
+        # as a task.
+        call = self.call
+        if isinstance(call, Function):
+            args = []
+            if call.args:
+                for arg in call.args.statements:
+                    args.append(arg.eval_sync(env) if arg.sync else await arg.eval(env))
+            body, frame = call.enter(env, args)
+            return env.spawn(run_body(body, frame, env), call.name)
+        if isinstance(call, Blocking):
+            return env.spawn(await call.start(env))
+        return env.spawn(call.eval_sync(env) if call.sync else await call.eval(env))
+
+class AwaitValue(Node):
+    __slots__ = fields = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    async def eval(self, env):
+        value = self.value.eval_sync(env) if self.value.sync else await self.value.eval(env)
+        return await value
+
+class Gather(Node):
+    __slots__ = fields = ('args',)
+
+    def __init__(self, args):
+        self.args = args.statements
+
+    async def eval(self, env):
+        values = []
+        for arg in self.args:
+            values.append(arg.eval_sync(env) if arg.sync else await arg.eval(env))
+        return list(await asyncio.gather(*values))
+
+class Blocking(Node):
+    __slots__ = fields = ('call',)
+
+    def __init__(self, call):
+        if isinstance(call, Function):
+            raise TypeError("Only imported functions can be called as blocking")
+        self.call = call
+
+    async def start(self, env):
+        # Evaluates the arguments here and hands the call itself to the
+        # I/O pool, returning its future.
+        call = self.call
+        f = call.callee(env)
+        args, kwargs = await call.arguments(env)
+        return env.root.io.submit(f, *args, **kwargs)
+
+    async def eval(self, env):
+        return await (await self.start(env))
+
+class DecoratedFunction(Node):
+    __slots__ = ('first', 'second', 'function', 'paren', 'args', 'kwargs', 'target', 'plan')
+    fields = ('args', 'kwargs', 'function')
+
     def __init__(self, first, second, function, paren, args, kwargs):
         self.first = first
         self.second = second
@@ -470,9 +880,15 @@ class DecoratedFunction:
         else:
             self.args = None
         if kwargs:
-            self.kwargs = kwargs.statements
+            self.kwargs = kwargs.data
         else:
             self.kwargs = None
+        self.target = None
+        # Argument nodes and keyword names, fixed on the first call.
+        self.plan = None
+
+    make_plan = ImportedFunction.make_plan
+    arguments = ImportedFunction.arguments
     
     async def eval(self, env):
         def rename(newname):
@@ -480,71 +896,121 @@ class DecoratedFunction:
                 f.__name__ = newname
                 return f
             return decorator
-        if env.variables.get(self.first):
-            f = env.variables.get(self.first)
+        f = bound(self.target, env)
+        if f is not UNDEFINED:
             d = getattr(f, self.second)
-            kwargs = {}
-            if self.kwargs:
-                for k in self.kwargs:
-                    kwargs.update({k : await self.kwargs[k].eval(env)})
-            args = []
-            if self.args:
-                args = [await arg.eval(env) for arg in self.args]
-            if self.paren:
-                @rename(self.function.name)
-                @d(*args, **kwargs)
-                async def call(*fargs):
-                    for i in range(len(list(fargs))):
-                        env.variables.update({self.function.args[i].name:fargs[i]})
-                    await self.function.function.eval(env)
-            else:
-                @rename(self.function.name)
-                async def call(*fargs):
-                    for i in range(len(list(fargs))):
-                        env.variables.update({self.function.args[i].name:fargs[i]})
-                    await self.function.function.eval(env)
-                call = d(call)
-            env.decorators[self.function.name] = call
-            return call
-        elif env.imports.get(self.first):
-            f = env.variables.get(self.first)
-            d = getattr(f, self.second)
-            kwargs = {}
-            if self.kwargs:
-                for k in self.kwargs:
-                    kwargs.update({k : await self.kwargs[k].eval(env)})
-            args = []
-            if self.args:
-                args = [await arg.eval(env) for arg in self.args]
-            if self.paren:
-                @rename(self.function.name)
-                @d(*args, **kwargs)
-                async def call(*fargs):
-                    for i in range(len(list(fargs))):
-                        env.variables.update({self.function.args[i].name:fargs[i]})
-                    await self.function.function.eval(env)
-            else:
-                @rename(self.function.name)
-                async def call(*fargs):
-                    for i in range(len(list(fargs))):
-                        env.variables.update({self.function.args[i].name:fargs[i]})
-                    await self.function.function.eval(env)
-                call = d(call)
-            env.decorators[self.function.name] = call
-            return call
-        raise NameError("Variable is not defined")
-
-class Index:
-    def __init__(self, objectz, index):
-        self.object = objectz
-        self.index = index
-    
-    async def eval(self, env):
-        while True:
+        else:
+            d = imported(env, self.first, self.second)
+        if d is None:
+            raise NameError("Variable is not defined")
+        function = self.function
+        params = len(function.args or [])
+
+        @rename(function.name)
+        async def call(*fargs):
+            frame = env.new_frame(function.nlocals)
+            n = min(params, len(fargs))
+            frame.locals[:n] = fargs[:n]
             try:
-                to_return = self.object[self.index]
-                return to_return
-            except TypeError:
-                self.object = await self.object.eval(env)
-            
-        
\ No newline at end of file
+                await function.function.eval(frame)
+            except FunctionReturn:
+                pass
+            finally:
+                env.release(frame)
+
+        if self.paren:
+            args, kwargs = await self.arguments(env)
+            call = d(*args, **kwargs)(call)
+        else:
+            call = d(call)
+        env.decorators[function.name] = call
+        return call
+
+# Decorators built into the interpreter, by (namespace, name).
+def decorated(first, second, function, paren, args, kwargs):
+    if (first, second) == ('mellow', 'memoize'):
+        return Memoize(function, args, kwargs)
+    return DecoratedFunction(first, second, function, paren, args, kwargs)
+
+class MemoBody(Node):
+    # The body of a memoized function: looks the parameters up in the
+    # function's Memo before running the body, and stores what it returns.
+    __slots__ = ('body', 'params', 'memo')
+    fields = ('body',)
+
+    def __init__(self, body, params):
+        self.body = body
+        self.params = params
+        self.memo = None
+
+    async def eval(self, env):
+        memo = self.memo
+        key = memo.key(env.locals, self.params)
+        if key is not None:
+            value = memo.get(key)
+            if value is not MISSING:
+                return value
+        body = self.body
+        try:
+            value = body.eval_sync(env) if body.sync else await body.eval(env)
+        except FunctionReturn as r:
+            value = r.value
+        if key is not None:
+            memo.put(key, value)
+        return value
+
+    def eval_sync(self, env):
+        memo = self.memo
+        key = memo.key(env.locals, self.params)
+        if key is not None:
+            value = memo.get(key)
+            if value is not MISSING:
+                return value
+        try:
+            value = self.body.eval_sync(env)
+        except FunctionReturn as r:
+            value = r.value
+        if key is not None:
+            memo.put(key, value)
+        return value
+
+class Memoize(Node):
+    # @mellow.memoize or @mellow.memoize(maxsize = n) on a def. Defining the
+    # function starts it with an empty cache. The resolver rejects bodies
+    # that are not pure (see mellowresolver.impurity).
+    __slots__ = ('name', 'function', 'args', 'kwargs', 'plan')
+    fields = ('args', 'kwargs', 'function')
+
+    def __init__(self, function, args, kwargs):
+        self.name = function.name
+        self.function = function
+        function.function = MemoBody(function.function, len(function.args or []))
+        self.args = args.statements if args else None
+        self.kwargs = kwargs.data if kwargs else None
+        self.plan = None
+
+    make_plan = ImportedFunction.make_plan
+    arguments = ImportedFunction.arguments
+
+    def define(self, env, args, kwargs):
+        if len(args) > 1 or set(kwargs) - {'maxsize'} or (args and kwargs):
+            raise TypeError("memoize takes one argument, maxsize")
+        maxsize = kwargs.get('maxsize', args[0] if args else 128)
+        memo = self.function.function.memo = Memo(self.name, maxsize)
+        env.root.memos[self.name] = memo
+        env.functions[self.name] = self.function
+        return self.name
+
+    async def eval(self, env):
+        args, kwargs = await self.arguments(env)
+        return self.define(env, args, kwargs)
+
+    def eval_sync(self, env):
+        positional, names, values = self.plan or self.make_plan()
+        return self.define(env, [arg.eval_sync(env) for arg in positional],
+                           dict(zip(names, [value.eval_sync(env) for value in values])))
+
+class Index(BinaryOp):
+    # x[i]: the object on the left, any expression as the index.
+    __slots__ = ()
+    apply = staticmethod(operator.getitem)
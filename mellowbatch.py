@@ -0,0 +1,148 @@
+from mellowloader import Loader
+from mellowenv import Environment
+from mellowio import IOPool
+import multiprocessing
+import contextlib
+import traceback
+import argparse
+import asyncio
+import time
+import json
+import sys
+import io
+import os
+
+# State of one pool worker: a Loader with the lexer and parser tables
+# loaded, and an I/O pool shared by the scripts it runs, as in the daemon.
+worker = None
+
+class Worker:
+    def __init__(self, optimize, cache, engine, io_workers):
+        self.loader = Loader(optimize, cache)
+        self.loader.get_parser()
+        self.engine = engine
+        self.io = IOPool(io_workers)
+
+    def run(self, path):
+        # Runs one script to the end and reports how it went; nothing the
+        # script does is allowed to take the worker down with it.
+        out = io.StringIO()
+        err = io.StringIO()
+        status = 0
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            try:
+                program = self.loader.load(path)
+                env = Environment()
+                env.io = self.io
+                asyncio.run(self.loader.run(program, env, self.engine))
+            except SystemExit as e:
+                status = e.code if isinstance(e.code, int) else 1
+            except BaseException:
+                traceback.print_exc()
+                status = 1
+        return {
+            'path': path,
+            'status': status,
+            'seconds': time.perf_counter() - start,
+            'stdout': out.getvalue(),
+            'stderr': err.getvalue(),
+        }
+
+def init_worker(optimize, cache, engine, io_workers):
+    global worker
+    worker = Worker(optimize, cache, engine, io_workers)
+
+def run_script(path):
+    return worker.run(path)
+
+def read_manifest(path):
+    # One script per line, relative to the manifest; blank lines and lines
+    # starting with # are skipped.
+    base = os.path.dirname(os.path.abspath(path))
+    scripts = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                scripts.append(os.path.join(base, line))
+    return scripts
+
+def expand(paths):
+    # Directories stand for every .mlw file under them.
+    scripts = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, dirs, files in os.walk(path):
+                dirs.sort()
+                scripts.extend(os.path.join(directory, name) for name in sorted(files)
+                               if name.endswith('.mlw'))
+        else:
+            scripts.append(path)
+    return scripts
+
+def run_all(scripts, jobs, options):
+    args = (options.optimize, options.cache, options.engine, options.io_threads)
+    if jobs == 1:
+        init_worker(*args)
+        yield from map(run_script, scripts)
+        return
+    with multiprocessing.Pool(jobs, init_worker, args) as pool:
+        # Unordered, so one slow script does not hold back the report of
+        # the ones that finished after it.
+        yield from pool.imap_unordered(run_script, scripts)
+
+def report(result, file):
+    state = 'ok  ' if result['status'] == 0 else 'FAIL'
+    print("%s %8.3fs  %s" % (state, result['seconds'], result['path']), file=file)
+    if result['status'] != 0:
+        for line in result['stderr'].rstrip().splitlines()[-5:]:
+            print("      " + line, file=file)
+
+def main(argv=None):
+    argparser = argparse.ArgumentParser(prog='mellow run')
+    argparser.add_argument('scripts', nargs='*', help='scripts, or directories of .mlw files')
+    argparser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                           help='worker processes (default: one per CPU)')
+    argparser.add_argument('--manifest', metavar='FILE',
+                           help='file listing one script per line')
+    argparser.add_argument('-O', dest='optimize', type=int, choices=[0, 1], default=1)
+    argparser.add_argument('--engine', choices=['vm', 'ast'], default='vm')
+    argparser.add_argument('--no-cache', dest='cache', action='store_false')
+    argparser.add_argument('--io-threads', type=int, default=None, metavar='N',
+                           help='I/O threads per worker')
+    argparser.add_argument('--json', metavar='FILE',
+                           help='write every result, output included, here')
+    argparser.add_argument('--show-output', action='store_true',
+                           help="print each script's output after its result line")
+    options = argparser.parse_args(argv)
+
+    scripts = expand(options.scripts)
+    if options.manifest:
+        scripts.extend(read_manifest(options.manifest))
+    if not scripts:
+        argparser.error("no scripts given")
+    jobs = max(1, min(options.jobs, len(scripts)))
+
+    order = {path: i for i, path in enumerate(scripts)}
+    results = []
+    start = time.perf_counter()
+    for result in run_all(scripts, jobs, options):
+        results.append(result)
+        report(result, sys.stdout)
+        if options.show_output and result['stdout']:
+            sys.stdout.write(result['stdout'])
+    wall = time.perf_counter() - start
+    results.sort(key=lambda result: order[result['path']])
+
+    failed = [result for result in results if result['status'] != 0]
+    busy = sum(result['seconds'] for result in results)
+    print("%d scripts, %d failed, %d jobs: %.2fs wall, %.2fs in scripts" % (
+        len(results), len(failed), jobs, wall, busy))
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump({'jobs': jobs, 'wall': wall, 'results': results}, f, indent=1)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
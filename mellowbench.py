@@ -0,0 +1,291 @@
+from mellowlexer import Lexer
+from mellowparser import Parser
+from mellowloader import Loader
+from mellowenv import Environment
+from mellowoptimizer import Optimizer
+from mellowresolver import Resolver
+from mellowanalysis import mark_sync
+from mellowast import NODE_BYTES, children
+import contextlib
+import statistics
+import subprocess
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import asyncio
+import time
+import json
+import sys
+import gc
+import os
+
+BENCHMARKS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks')
+
+PHASES = ('lex', 'parser', 'parse', 'prepare', 'eval')
+
+def flat_source(statements=3000):
+    # A large generated script with no functions: one long top level.
+    lines = []
+    for i in range(statements):
+        if i % 3 == 0:
+            lines.append('v%d = %d * 3 + %d' % (i, i, i % 7))
+        elif i % 3 == 1:
+            lines.append('v%d = v%d - %d / 2' % (i, i - 1, i))
+        else:
+            lines.append('v%d = "s%d"' % (i, i))
+    lines.append('print(v%d)' % (statements - 2))
+    return '\n'.join(lines) + '\n'
+
+def deep_source(depth=40):
+    # if/else nested `depth` levels, called a few hundred times.
+    lines = ['import builtins', 'def walk(n):']
+    for level in range(depth):
+        indent = '    ' * (level + 1)
+        lines.append('%sif n > %d:' % (indent, level))
+    lines.append('%sreturn %d' % ('    ' * (depth + 1), depth))
+    for level in reversed(range(depth)):
+        indent = '    ' * (level + 1)
+        lines.append('%selse:' % indent)
+        lines.append('%s    return %d' % (indent, level))
+        lines.append('%send' % indent)
+    lines.append('end')
+    lines.append('total = 0')
+    lines.append('for i in builtins.range(512):')
+    lines.append('    total = total + walk(i / 8)')
+    lines.append('end')
+    lines.append('print(total)')
+    return '\n'.join(lines) + '\n'
+
+GENERATED = {
+    'flat': flat_source,
+    'deep': deep_source,
+}
+
+def corpus():
+    sources = {}
+    for name in sorted(os.listdir(BENCHMARKS)):
+        if name.endswith('.mlw'):
+            with open(os.path.join(BENCHMARKS, name)) as f:
+                sources[name[:-4]] = f.read()
+    for name, make in GENERATED.items():
+        sources[name] = make()
+    return sources
+
+def write_data(directory):
+    # The file files.mlw reads: about 256 KB of short lines.
+    with open(os.path.join(directory, 'bench-data.txt'), 'w') as f:
+        for i in range(16384):
+            f.write('line %08d of the benchmark data\n' % i)
+
+def summary(runs):
+    return {
+        'min': min(runs),
+        'median': statistics.median(runs),
+        'mean': statistics.fmean(runs),
+        'stdev': statistics.stdev(runs) if len(runs) > 1 else 0.0,
+        'runs': runs,
+    }
+
+# Times each phase of running one script on its own: lexing, building the
+# parser (from cached tables, as every run does), parsing, the passes that
+# prepare the tree, and evaluation. Each phase gets fresh input, so a run
+# never sees state left by the one before.
+class Bench:
+    def __init__(self, warmup=1, repeat=5, engine='vm', optimize=1, workdir=None):
+        self.warmup = warmup
+        self.repeat = repeat
+        self.engine = engine
+        self.optimize = optimize
+        self.workdir = workdir
+        self.lexer = Lexer()
+        self.parser = Parser().get_parser()
+        self.loader = Loader(optimize, cache=False)
+
+    def measure(self, func, setup=None):
+        runs = []
+        for i in range(self.warmup + self.repeat):
+            arg = setup() if setup is not None else None
+            start = time.perf_counter()
+            func(arg)
+            elapsed = time.perf_counter() - start
+            if i >= self.warmup:
+                runs.append(elapsed)
+        return summary(runs)
+
+    def tokens(self, text):
+        return list(self.lexer.lex(text))
+
+    def parse(self, tokens):
+        return self.parser.parse(iter(tokens), Environment())
+
+    def prepare(self, program):
+        if self.optimize:
+            program = Optimizer().optimize(program)
+        Resolver().resolve_program(program)
+        mark_sync(program)
+        return program
+
+    def evaluate(self, program):
+        env = Environment()
+        env.cwd = self.workdir
+        with contextlib.redirect_stdout(open(os.devnull, 'w')) as out:
+            try:
+                asyncio.run(self.loader.run(program, env, self.engine))
+            finally:
+                env.io.shutdown()
+                out.close()
+
+    def run(self, source):
+        tokens = self.tokens(source)
+        return {
+            'lex': self.measure(lambda _: self.tokens(source)),
+            'parser': self.measure(lambda _: Parser().get_parser()),
+            'parse': self.measure(self.parse, lambda: tokens),
+            'prepare': self.measure(self.prepare, lambda: self.parse(tokens)),
+            'eval': self.measure(self.evaluate, lambda: self.prepare(self.parse(tokens))),
+        }
+
+def metadata(options):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARKS,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'commit': commit,
+        'engine': options.engine,
+        'optimize': options.optimize,
+        'warmup': options.warmup,
+        'repeat': options.repeat,
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+def run_command(options):
+    sources = corpus()
+    names = options.names or list(sources)
+    unknown = [name for name in names if name not in sources]
+    if unknown:
+        sys.exit("unknown benchmark: " + ", ".join(unknown))
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        write_data(workdir)
+        bench = Bench(options.warmup, options.repeat, options.engine, options.optimize, workdir)
+        print("%-10s %10s %10s %10s %10s %10s" % (('bench',) + PHASES), file=sys.stderr)
+        for name in names:
+            results[name] = bench.run(sources[name])
+            print("%-10s" % name + ''.join(' %10.3f' % (results[name][phase]['median'] * 1000)
+                                           for phase in PHASES) + '  ms', file=sys.stderr)
+    report = {'meta': metadata(options), 'results': results}
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump(report, f, indent=1)
+    return 0
+
+def count_nodes(program):
+    count = 0
+    stack = [program]
+    while stack:
+        count += 1
+        stack.extend(children(stack.pop()))
+    return count
+
+def tree_memory(loader, source):
+    # Node count and bytes still held once source is parsed and prepared:
+    # the nodes and everything they keep alive (names, constants, lists).
+    gc.collect()
+    tracemalloc.start()
+    try:
+        program = loader.compile_source(source)
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return count_nodes(program), size
+
+def memory_command(options):
+    sources = corpus()
+    names = options.names or list(sources)
+    unknown = [name for name in names if name not in sources]
+    if unknown:
+        sys.exit("unknown benchmark: " + ", ".join(unknown))
+    loader = Loader(options.optimize, cache=False)
+    loader.get_parser()
+    # Small scripts are dominated by fixed costs, so the target applies to
+    # the corpus as a whole.
+    total_nodes = total_size = 0
+    print("%-10s %9s %11s %11s" % ('bench', 'nodes', 'KB', 'bytes/node'))
+    for name in names:
+        nodes, size = tree_memory(loader, sources[name])
+        total_nodes += nodes
+        total_size += size
+        print("%-10s %9d %11.1f %11.1f" % (name, nodes, size / 1024, size / nodes))
+    average = total_size / total_nodes
+    over = average > NODE_BYTES
+    print("%-10s %9d %11.1f %11.1f%s" % ('total', total_nodes, total_size / 1024, average,
+                                         '  OVER %d' % NODE_BYTES if over else ''))
+    return 1 if over else 0
+
+def compare(base, new, threshold):
+    # Median ratios new/base per benchmark and phase; anything slower by
+    # more than threshold is a regression.
+    rows = []
+    for name in sorted(set(base['results']) & set(new['results'])):
+        for phase in PHASES:
+            old = base['results'][name].get(phase)
+            cur = new['results'][name].get(phase)
+            if not old or not cur or not old['median']:
+                continue
+            ratio = cur['median'] / old['median']
+            rows.append((name, phase, old['median'], cur['median'], ratio, ratio > 1 + threshold))
+    return rows
+
+def compare_command(options):
+    with open(options.base) as f:
+        base = json.load(f)
+    with open(options.new) as f:
+        new = json.load(f)
+    rows = compare(base, new, options.threshold)
+    regressions = 0
+    print("%-10s %-8s %11s %11s %8s" % ('bench', 'phase', 'base ms', 'new ms', 'ratio'))
+    for name, phase, old, cur, ratio, regressed in rows:
+        flag = '  REGRESSION' if regressed else ''
+        regressions += regressed
+        print("%-10s %-8s %11.3f %11.3f %7.2fx%s" % (name, phase, old * 1000, cur * 1000, ratio, flag))
+    if regressions:
+        print("%d regression(s) over %.0f%%" % (regressions, options.threshold * 100))
+        return 1
+    return 0
+
+def main(argv=None):
+    argparser = argparse.ArgumentParser(prog='mellowbench')
+    commands = argparser.add_subparsers(dest='command')
+    run = commands.add_parser('run', help='time the corpus and optionally save JSON')
+    run.add_argument('names', nargs='*', help='benchmarks to run (default: all)')
+    run.add_argument('--warmup', type=int, default=1)
+    run.add_argument('--repeat', type=int, default=5)
+    run.add_argument('--engine', choices=['vm', 'ast'], default='vm')
+    run.add_argument('-O', dest='optimize', type=int, choices=[0, 1], default=1)
+    run.add_argument('--json', metavar='FILE', help='write the results here')
+    mem = commands.add_parser('memory', help='measure prepared tree memory per node')
+    mem.add_argument('names', nargs='*', help='benchmarks to measure (default: all)')
+    mem.add_argument('-O', dest='optimize', type=int, choices=[0, 1], default=1)
+    cmp = commands.add_parser('compare', help='compare two saved runs')
+    cmp.add_argument('base')
+    cmp.add_argument('new')
+    cmp.add_argument('--threshold', type=float, default=0.10,
+                     help='slowdown that counts as a regression (default 0.10)')
+    options = argparser.parse_args(argv)
+    if options.command == 'compare':
+        return compare_command(options)
+    if options.command == 'memory':
+        return memory_command(options)
+    if options.command is None:
+        options = argparser.parse_args(['run'] + (argv or sys.argv[1:]))
+    return run_command(options)
+
+if __name__ == '__main__':
+    sys.exit(main())
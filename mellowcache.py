@@ -0,0 +1,91 @@
+from appdirs import user_cache_dir
+import importlib.util
+import hashlib
+import pickle
+import sys
+import os
+
+# The modules that define the tree and the passes that prepare it. The cache
+# header identifies the build of them it was written by, so trees pickled by
+# an interpreter with different classes or passes are rebuilt instead of
+# loaded.
+TREE_MODULES = ('mellowast', 'mellowlexer', 'mellowparser', 'mellowoptimizer',
+                'mellowresolver', 'mellowanalysis', 'mellowmemo', 'mellowcache')
+magic = None
+
+def build_id():
+    # A frozen executable (see mellow.spec) ships the modules compiled inside
+    # it, so it stands for them itself. Otherwise each module's file is
+    # stat()ed, not read, much as Python checks a .pyc against its source.
+    if getattr(sys, 'frozen', False):
+        stats = [(sys.executable, os.stat(sys.executable))]
+    else:
+        stats = [(name, os.stat(importlib.util.find_spec(name).origin)) for name in TREE_MODULES]
+    digest = hashlib.sha1()
+    for name, st in stats:
+        digest.update(('%s %d %d\n' % (name, st.st_size, st.st_mtime_ns)).encode())
+    return digest.digest()[:8]
+
+def get_magic():
+    # None when the build cannot be identified, which turns the cache off.
+    global magic
+    if magic is None:
+        try:
+            magic = ('MLWC-%s-' % sys.implementation.cache_tag).encode() + build_id()
+        except (OSError, ImportError, AttributeError, TypeError, ValueError):
+            magic = b''
+    return magic or None
+
+def cache_dir():
+    return os.environ.get('MELLOW_CACHE_DIR') or user_cache_dir('mellow')
+
+def source_hash(source):
+    return hashlib.sha1(source.encode('utf-8')).digest()
+
+def cache_paths(path, level):
+    # Like __pycache__: next to the script first, then the user cache dir
+    # for scripts in read-only directories.
+    path = os.path.abspath(path)
+    directory, name = os.path.split(path)
+    name = '%s.O%d.mlwc' % (name, level)
+    digest = hashlib.sha1(path.encode('utf-8')).hexdigest()[:16]
+    return [
+        os.path.join(directory, '__mellowcache__', name),
+        os.path.join(cache_dir(), 'mlwc', digest + '-' + name),
+    ]
+
+def load(path, source, level):
+    if get_magic() is None:
+        return None
+    header = get_magic() + source_hash(source)
+    for cached in cache_paths(path, level):
+        try:
+            with open(cached, 'rb') as f:
+                if f.read(len(header)) != header:
+                    continue
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            continue
+    return None
+
+def store(path, source, level, program):
+    # Called before the program runs: evaluation caches values on some
+    # nodes, and those must not end up in the file.
+    if get_magic() is None:
+        return None
+    try:
+        data = pickle.dumps(program, pickle.HIGHEST_PROTOCOL)
+    except RecursionError:
+        return None
+    for cached in cache_paths(path, level):
+        try:
+            os.makedirs(os.path.dirname(cached), exist_ok=True)
+            temp = '%s.%d.tmp' % (cached, os.getpid())
+            with open(temp, 'wb') as f:
+                f.write(get_magic() + source_hash(source))
+                f.write(data)
+            os.replace(temp, cached)
+            return cached
+        except OSError:
+            continue
+    return None
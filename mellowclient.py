@@ -0,0 +1,79 @@
+import argparse
+import socket
+import json
+import sys
+import os
+
+# Kept to the standard library: this runs once per script, so it must start
+# faster than the interpreter it talks to.
+
+def socket_dir():
+    # $XDG_RUNTIME_DIR is open to this user only. Without it, a directory of
+    # the user's own under TMPDIR, which the daemon makes 0700. tempfile
+    # would work out TMPDIR the same way, but costs more to import than the
+    # rest of this module.
+    return os.environ.get('XDG_RUNTIME_DIR') or os.path.join(
+        os.environ.get('TMPDIR') or '/tmp', 'mellow-%d' % os.getuid())
+
+def default_socket():
+    return os.environ.get('MELLOW_SOCKET') or os.path.join(socket_dir(), 'mellow.sock')
+
+def check_owner(path, private=False):
+    # A socket, or a directory to hold one, that another user owns (or, for
+    # a private directory, can get into) could put their daemon in the place
+    # of ours.
+    st = os.lstat(path)
+    if st.st_uid != os.getuid():
+        raise PermissionError("%s belongs to another user" % path)
+    if private and st.st_mode & 0o077:
+        raise PermissionError("%s is open to other users" % path)
+
+def run(path=None, source=None, engine=None, optimize=None, address=None,
+        out=sys.stdout, err=sys.stderr):
+    # Sends one script to a `mellow --serve` daemon, copies what it prints to
+    # out and err, and returns its exit status.
+    request = {'path': path, 'source': source, 'cwd': os.getcwd()}
+    if engine is not None:
+        request['engine'] = engine
+    if optimize is not None:
+        request['optimize'] = optimize
+    address = address or default_socket()
+    check_owner(address)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(address)
+        s.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        for line in s.makefile('rb'):
+            message = json.loads(line)
+            if 'out' in message:
+                out.write(message['out'])
+            elif 'err' in message:
+                err.write(message['err'])
+            elif 'exit' in message:
+                out.flush()
+                return message['exit']
+    err.write("mellow daemon closed the connection\n")
+    return 1
+
+def main(argv=None):
+    argparser = argparse.ArgumentParser(prog='mellowclient')
+    argparser.add_argument('file', help="script to run, or - to read it from stdin")
+    argparser.add_argument('--socket', default=None, help='daemon socket path')
+    argparser.add_argument('-O', dest='optimize', type=int, choices=[0, 1], default=None)
+    argparser.add_argument('--engine', choices=['vm', 'ast'], default=None)
+    options = argparser.parse_args(argv)
+    if options.file == '-':
+        path, source = None, sys.stdin.read()
+    else:
+        path, source = os.path.abspath(options.file), None
+    try:
+        return run(path, source, options.engine, options.optimize, options.socket)
+    except (FileNotFoundError, ConnectionRefusedError):
+        print("No mellow daemon on %s; start one with mellow.py --serve"
+              % (options.socket or default_socket()), file=sys.stderr)
+        return 2
+    except PermissionError as e:
+        print("Not connecting: %s" % e, file=sys.stderr)
+        return 2
+
+if __name__ == '__main__':
+    sys.exit(main())
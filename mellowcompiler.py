@@ -0,0 +1,446 @@
+from mellowast import *
+from mellowenv import UNDEFINED
+from mellowio import File, Lines
+from mellowmemo import MISSING
+import functools
+import asyncio
+import keyword
+import math
+import types
+
+# Lowers Mellow code to Python source, compiled into plain Python functions:
+# locals become Python variables (or a frame's slots), if/while/for become
+# Python statements, arithmetic runs as Python operators and a return is a
+# Python return. Nodes without a lowering are kept as constants and run by
+# the tree walker with the current environment.
+#
+# A compiled function is called as code(env, *args) and stored on its
+# AssignmentFunction. Functions are compiled on their first call; until
+# then code is a stub that compiles the function and calls it. Top-level
+# statements run once, so only those with a loop or a call in them
+# (Program.hot) are compiled; runs of the others are handed to the tree
+# walker as a Block.
+
+OPERATORS = {
+    Sum: '+',
+    Sub: '-',
+    Mul: '*',
+    Div: '/',
+    Equal: '==',
+    NotEqual: '!=',
+    GreaterThan: '>',
+    LessThan: '<',
+    GreaterThanEqual: '>=',
+    LessThanEqual: '<=',
+}
+
+# Constant values written into the source as literals.
+LITERAL_TYPES = (int, str, bool, type(None))
+
+class Code:
+    # A compiled program or function: its Python source, kept for reading,
+    # and the function it defines.
+    def __init__(self, name, source, function):
+        self.name = name
+        self.source = source
+        self.function = function
+        self.coroutine = asyncio.iscoroutinefunction(function)
+
+def undefined_slot(env, name, slots, slot):
+    # A variable read before it was assigned: see mellowast.undefined. The
+    # value found is kept in the slot, as Variable.eval_sync does.
+    value = slots[slot] = undefined(env, name)
+    return value
+
+async def run_code(function, env, args):
+    value = function.code(env, *args)
+    if type(value) is types.CoroutineType:
+        value = await value
+    return value
+
+def spawn_call(env, name, args):
+    # spawn f(x): the arguments are already evaluated and the function is
+    # looked up now; the call itself runs as a task.
+    function = env.functions[name]
+    if len(args) < len(function.args or []):
+        raise TypeError(name + "() missing required arguments.")
+    return env.spawn(run_code(function, env, args), name)
+
+# Names the generated code uses besides K, its constants.
+RUNTIME = {
+    'U': UNDEFINED,
+    'MISSING': MISSING,
+    'CORO': types.CoroutineType,
+    'File': File,
+    'Lines': Lines,
+    'asyncio': asyncio,
+    'undefined': undefined,
+    'undefined_slot': undefined_slot,
+    'spawn_call': spawn_call,
+}
+
+def reads_locals(node):
+    # Whether the tree walker running node would read or write slots of the
+    # frame it is given. Function definitions inside have frames of their own.
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Variable) and node.depth == 0:
+            return True
+        target = getattr(node, 'target', None)
+        if isinstance(target, Variable) and target.depth == 0:
+            return True
+        if isinstance(node, AssignmentFunction):
+            continue
+        stack.extend(children(node))
+    return False
+
+class Escape(Exception):
+    # Raised while compiling a function into Python variables when some node
+    # has to be run by the tree walker with the function's frame.
+    pass
+
+class Unit:
+    # The source of one generated Python function being written.
+    def __init__(self, compiler, frame):
+        self.compiler = compiler
+        # Whether locals live in a frame's slots (L) rather than in Python
+        # variables v0, v1...
+        self.frame = frame
+        self.lines = []
+        self.indent = 1
+        # Local slots assigned on every path to the code being written; a
+        # read of any other local checks for UNDEFINED.
+        self.assigned = set()
+        self.loops = 0
+        self.uses = set()
+
+    def prologue(self):
+        # Tables the code reads, fetched once per call.
+        lines = []
+        if 'G' in self.uses:
+            lines.append('    G = env.globals')
+        if 'F' in self.uses:
+            lines.append('    F = env.functions')
+        return lines
+
+    def emit(self, line):
+        self.lines.append('    ' * self.indent + line)
+
+    def const(self, value):
+        return self.compiler.const(value)
+
+    def nested(self, body, tail, target=None):
+        # Writes body one level in; what it assigns may not have run after it.
+        assigned = set(self.assigned)
+        if target is not None and target.depth == 0:
+            self.assigned.add(target.slot)
+        self.indent += 1
+        self.statement(body, tail)
+        self.indent -= 1
+        self.assigned = assigned
+
+    def slot(self, variable):
+        if variable.depth == 1:
+            self.uses.add('G')
+            return 'G[%d]' % variable.slot
+        if self.frame:
+            return 'L[%d]' % variable.slot
+        return 'v%d' % variable.slot
+
+    def fallback(self, node):
+        if not self.frame and reads_locals(node):
+            raise Escape()
+        if node.sync:
+            return 'K[%d].eval_sync(env)' % self.const(node)
+        return '(await K[%d].eval(env))' % self.const(node)
+
+    # Statements. A statement in tail position returns its value.
+
+    def statements(self, statements, tail):
+        last = len(statements) - 1
+        for i, statement in enumerate(statements):
+            self.statement(statement, tail and i == last)
+
+    def statement(self, node, tail):
+        method = getattr(self, 'statement_' + type(node).__name__, None)
+        if method is not None:
+            method(node, tail)
+        elif tail:
+            self.emit('return ' + self.expr(node))
+        else:
+            self.emit(self.expr(node))
+
+    def statement_Block(self, node, tail):
+        self.statements(node.statements, tail)
+
+    def statement_Assignment(self, node, tail):
+        if not isinstance(node.left, Variable):
+            self.emit(self.fallback(node))
+            return
+        self.emit('%s = %s' % (self.slot(node.left), self.expr(node.right)))
+        if node.left.depth == 0:
+            self.assigned.add(node.left.slot)
+
+    def statement_Print(self, node, tail):
+        self.emit('print(%s)' % self.expr(node.value))
+
+    def statement_Return(self, node, tail):
+        self.emit('return ' + self.expr(node.exp))
+
+    def statement_AssignmentFunction(self, node, tail):
+        self.uses.add('F')
+        self.emit('F[%r] = K[%d]' % (node.name, self.const(node)))
+        if tail:
+            self.emit('return %r' % node.name)
+
+    def statement_If(self, node, tail):
+        self.emit('if %s:' % self.expr(node.condition))
+        self.nested(node.body, tail)
+        if node.elif_condition is not None and node.elif_body is not None:
+            self.emit('elif %s:' % self.expr(node.elif_condition))
+            self.nested(node.elif_body, tail)
+        if node.else_body is not None:
+            self.emit('else:')
+            self.nested(node.else_body, tail)
+
+    def statement_While(self, node, tail):
+        self.emit('while %s:' % self.expr(node.condition))
+        self.nested(node.body, False)
+
+    def statement_For(self, node, tail):
+        target = self.slot(node.target)
+        values = self.expr(node.iterable)
+        if node.sync:
+            self.emit('for %s in %s:' % (target, values))
+            self.nested(node.body, False, node.target)
+            return
+        # A file's lines come a batch at a time (see mellowio.Lines): the
+        # inner loop runs over each batch, the outer one reads the next.
+        self.loops += 1
+        it = 'it%d' % self.loops
+        self.emit('%s = %s' % (it, values))
+        self.emit('if type(%s) is File:' % it)
+        self.emit('    %s = Lines(%s)' % (it, it))
+        self.emit('while True:')
+        self.indent += 1
+        self.emit('for %s in %s:' % (target, it))
+        self.nested(node.body, False, node.target)
+        self.emit('if type(%s) is not Lines or not await %s.refill(env.root.io):' % (it, it))
+        self.emit('    break')
+        self.indent -= 1
+
+    # Expressions.
+
+    def expr(self, node):
+        op = OPERATORS.get(type(node))
+        if op is not None:
+            return '(%s %s %s)' % (self.expr(node.left), op, self.expr(node.right))
+        method = getattr(self, 'expr_' + type(node).__name__, None)
+        if method is None:
+            return self.fallback(node)
+        return method(node)
+
+    def literal(self, value):
+        if type(value) in LITERAL_TYPES or type(value) is float and math.isfinite(value):
+            return '(%r)' % (value,) if repr(value).startswith('-') else repr(value)
+        return 'K[%d]' % self.const(value)
+
+    def expr_Number(self, node):
+        return self.literal(node.value)
+
+    expr_String = expr_Boolean = expr_Constant = expr_Number
+
+    def expr_Variable(self, node):
+        slot = self.slot(node)
+        if node.depth == 0 and node.slot in self.assigned:
+            return slot
+        if node.depth == 0 and not self.frame:
+            return '(%s if %s is not U else undefined(env, %r))' % (slot, slot, node.name)
+        slots = 'G' if node.depth == 1 else 'L'
+        return '(t if (t := %s) is not U else undefined_slot(env, %r, %s, %d))' % (
+            slot, node.name, slots, node.slot)
+
+    def expr_Index(self, node):
+        return '%s[%s]' % (self.expr(node.left), self.expr(node.right))
+
+    def expr_Array(self, node):
+        return '[%s]' % ', '.join(self.expr(value) for value in node.statements)
+
+    def expr_Dict(self, node):
+        return '{%s}' % ', '.join('%s: %s' % (self.expr(k), self.expr(v)) for k, v in node.data.items())
+
+    def expr_Print(self, node):
+        return 'print(%s)' % self.expr(node.value)
+
+    def expr_Sleep(self, node):
+        return '(await asyncio.sleep(%s))' % self.expr(node.time)
+
+    def expr_Function(self, node):
+        args = ''.join(', ' + self.expr(arg) for arg in node.args.statements) if node.args else ''
+        self.uses.add('F')
+        call = 'F[%r].code(env%s)' % (node.name, args)
+        if node.sync:
+            return call
+        # Suspends when the function turns out to: see mellowanalysis.
+        return '(await t if type(t := %s) is CORO else t)' % call
+
+    def expr_Spawn(self, node):
+        call = node.call
+        if not isinstance(call, Function):
+            return self.fallback(node)
+        args = [self.expr(arg) for arg in call.args.statements] if call.args else []
+        return 'spawn_call(env, %r, (%s))' % (call.name, ''.join(arg + ', ' for arg in args))
+
+    def attribute(self, node, name):
+        # The attribute of the receiver variable, or the name looked up in
+        # the import when the variable was never assigned.
+        if node.target is None:
+            return 'K[%d].lookup(env)' % self.const(node)
+        if name.isidentifier() and not keyword.iskeyword(name):
+            get = 't.' + name
+        else:
+            get = 'getattr(t, %r)' % name
+        return '(%s if (t := %s) is not U else K[%d].lookup(env))' % (
+            get, self.slot(node.target), self.const(node))
+
+    def expr_GetAttr(self, node):
+        return self.attribute(node, node.right)
+
+    def expr_ImportedFunction(self, node):
+        args = [self.expr(arg) for arg in node.args or ()]
+        for name, value in (node.kwargs or {}).items():
+            if name.isidentifier() and not keyword.iskeyword(name):
+                args.append('%s=%s' % (name, self.expr(value)))
+            else:
+                args.append('**{%r: %s}' % (name, self.expr(value)))
+        return '%s(%s)' % (self.attribute(node, node.function), ', '.join(args))
+
+class Compiler:
+    def __init__(self):
+        self.consts = []
+        self.indexes = {}
+
+    def const(self, value):
+        # Keyed by identity so 1, 1.0 and True stay distinct constants.
+        i = self.indexes.get(id(value))
+        if i is None:
+            i = self.indexes[id(value)] = len(self.consts)
+            self.consts.append(value)
+        return i
+
+    def build(self, name, lines):
+        source = '\n'.join(lines) + '\n'
+        namespace = dict(RUNTIME, K=tuple(self.consts))
+        exec(compile(source, '<mellow %s>' % name, 'exec'), namespace)
+        return Code(name, source, namespace['mellow'])
+
+    def compile_program(self, program):
+        self.consts, self.indexes = [], {}
+        unit = Unit(self, True)
+        statements = program.statements
+        start = 0
+        for i in program.hot:
+            self.cold(unit, statements[start:i], False, program.sync)
+            unit.statement(statements[i], i == len(statements) - 1)
+            start = i + 1
+        self.cold(unit, statements[start:], True, program.sync)
+        header = 'def' if program.sync else 'async def'
+        lines = ['%s mellow(env):' % header, '    L = env.locals']
+        return self.build('<program>', lines + unit.prologue() + (unit.lines or ['    pass']))
+
+    def cold(self, unit, statements, tail, sync):
+        # Top-level statements with nothing worth compiling, run by the tree
+        # walker as one Block; sync when the whole program is.
+        if not statements:
+            return
+        block = Block(statements[0])
+        block.statements = statements
+        block.sync = sync or all(statement.sync for statement in statements)
+        unit.emit(('return ' if tail else '') + unit.fallback(block))
+
+    def reset(self, functions):
+        # Compiled code depends on the sync marks of the calls in it, so
+        # functions re-marked since they were compiled (see
+        # mellowanalysis.StreamAnalysis) go back to compiling on their next
+        # call.
+        for node in functions:
+            node.code = functools.partial(compile_on_call, node)
+
+    def compile_function(self, node):
+        self.consts, self.indexes = [], {}
+        try:
+            lines = self.function_lines(node, False)
+        except Escape:
+            self.consts, self.indexes = [], {}
+            lines = self.function_lines(node, True)
+        code = self.build(node.name, lines)
+        node.code = code.function
+        return code
+
+    def function_lines(self, node, frame):
+        params = len(node.args or [])
+        names = ['v%d' % i for i in range(params)]
+        body = node.function
+        memo = body if isinstance(body, MemoBody) else None
+        if memo is not None:
+            body = memo.body
+        unit = Unit(self, frame)
+        unit.assigned = set(range(params))
+        unit.statement(body, True)
+        header = 'def' if body.sync else 'async def'
+        lines = []
+        signature = ''.join(', %s=MISSING' % name for name in names)
+        if memo is None:
+            lines.append('%s mellow(env%s, *rest):' % (header, signature))
+            lines.extend(self.check(node, names))
+        else:
+            lines.append('%s body(env%s):' % (header, ''.join(', ' + name for name in names)))
+        if frame:
+            lines.append('    env = env.new_frame(%d)' % node.nlocals)
+            lines.append('    L = env.locals')
+            if params:
+                lines.append('    L[:%d] = %s,' % (params, ', '.join(names)))
+        else:
+            if node.nlocals > params:
+                lines.append('    %s = U' % ' = '.join('v%d' % i for i in range(params, node.nlocals)))
+        lines.extend(unit.prologue())
+        if frame:
+            lines.append('    try:')
+            lines.extend('    ' + line for line in unit.lines)
+            lines.append('    finally:')
+            lines.append('        env.release(env)')
+        else:
+            lines.extend(unit.lines)
+        if memo is not None:
+            lines.extend(self.memo_lines(node, memo, names, header))
+        return lines
+
+    def check(self, node, names):
+        if not names:
+            return []
+        return ['    if %s is MISSING:' % names[-1],
+                '        raise TypeError(%r)' % (node.name + "() missing required arguments.")]
+
+    def memo_lines(self, node, memo, names, header):
+        # The function itself looks its arguments up in the Memo before
+        # running the body, and stores what the body returns.
+        args = ''.join(name + ', ' for name in names)
+        call = 'body(env, %s)' % args
+        if header != 'def':
+            call = 'await ' + call
+        lines = ['%s mellow(env%s, *rest):' % (header, ''.join(', %s=MISSING' % n for n in names))]
+        lines.extend(self.check(node, names))
+        lines.extend([
+            '    memo = K[%d].memo' % self.const(memo),
+            '    key = memo.key((%s), %d)' % (args, len(names)),
+            '    if key is not None:',
+            '        value = memo.get(key)',
+            '        if value is not MISSING:',
+            '            return value',
+            '    value = ' + call,
+            '    if key is not None:',
+            '        memo.put(key, value)',
+            '    return value',
+        ])
+        return lines
@@ -0,0 +1,174 @@
+from mellowloader import Loader
+from mellowenv import Environment
+from mellowio import IOPool
+from mellowclient import default_socket, socket_dir, check_owner
+import mellowcache
+import contextvars
+import traceback
+import asyncio
+import signal
+import threading
+import socket
+import pickle
+import json
+import sys
+import os
+
+# Prepared trees kept in memory, pickled, so every run gets its own copy.
+MAX_TREES = 256
+
+# Where print() output goes for the request being served by the current task.
+output = contextvars.ContextVar('output', default=None)
+
+class Router:
+    # Installed as sys.stdout: text printed while serving a request goes back
+    # to that request's client, anything else to the real stdout.
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        send = output.get()
+        if send is None:
+            return self.stream.write(text)
+        send(text)
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+# Runs scripts sent by mellowclient over a Unix socket, each in a fresh
+# Environment, with the lexer, parser tables and prepared trees already in
+# memory. Requests run concurrently on one event loop.
+class Daemon:
+    def __init__(self, address=None, optimize=1, cache=True, io_workers=None):
+        self.address = address or default_socket()
+        self.optimize = optimize
+        self.cache = cache
+        self.loaders = {}
+        self.trees = {}
+        self.io = IOPool(io_workers)
+
+    def loader(self, level):
+        loader = self.loaders.get(level)
+        if loader is None:
+            loader = Loader(level, self.cache)
+            for other in self.loaders.values():
+                loader.lexer, loader.parser = other.lexer, other.parser
+            loader.get_parser()
+            self.loaders[level] = loader
+        return loader
+
+    def prepare(self, request):
+        level = request.get('optimize', self.optimize)
+        loader = self.loader(level)
+        path = request.get('path')
+        source = request.get('source')
+        if source is None:
+            source = loader.read(path)
+        key = (path, level, mellowcache.source_hash(source))
+        data = self.trees.get(key)
+        if data is not None:
+            return loader, pickle.loads(data)
+        if path is None:
+            program = loader.compile_source(source)
+        else:
+            program = loader.load_source(path, source)
+        try:
+            data = pickle.dumps(program, pickle.HIGHEST_PROTOCOL)
+        except RecursionError:
+            return loader, program
+        if len(self.trees) >= MAX_TREES:
+            del self.trees[next(iter(self.trees))]
+        self.trees[key] = data
+        return loader, program
+
+    async def handle(self, reader, writer):
+        def send(**message):
+            # A client that went away still lets the script run to the end.
+            if writer.is_closing():
+                return
+            writer.write(json.dumps(message).encode('utf-8') + b'\n')
+
+        def write(text):
+            # Blocking calls print from I/O threads; the transport may only
+            # be written from the loop's thread.
+            if threading.get_ident() == thread:
+                send(out=text)
+            else:
+                loop.call_soon_threadsafe(lambda: send(out=text))
+
+        loop = asyncio.get_running_loop()
+        thread = threading.get_ident()
+        status = 0
+        token = output.set(write)
+        try:
+            request = json.loads(await reader.readline())
+            loader, program = self.prepare(request)
+            env = Environment()
+            env.io = self.io
+            env.cwd = request.get('cwd')
+            await loader.run(program, env, request.get('engine', 'vm'))
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else 1
+        except Exception:
+            send(err=traceback.format_exc())
+            status = 1
+        finally:
+            output.reset(token)
+        send(exit=status)
+        try:
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    def bind(self):
+        # The default directory is made on first use, and must be this
+        # user's alone.
+        directory = os.path.dirname(os.path.abspath(self.address))
+        if directory == os.path.abspath(socket_dir()):
+            os.makedirs(directory, 0o700, exist_ok=True)
+            check_owner(directory, private=True)
+        # A socket file left behind by a daemon that died is replaced; one
+        # that still answers belongs to a running daemon.
+        if os.path.lexists(self.address):
+            check_owner(self.address)
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.address)
+            except OSError:
+                os.unlink(self.address)
+            else:
+                raise OSError("a mellow daemon is already listening on " + self.address)
+            finally:
+                probe.close()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o177)
+        try:
+            # Anyone who can connect can run code as this user.
+            sock.bind(self.address)
+        finally:
+            os.umask(umask)
+        return sock
+
+    async def serve_forever(self):
+        self.loader(self.optimize)
+        sys.stdout = Router(sys.stdout)
+        server = await asyncio.start_unix_server(self.handle, sock=self.bind())
+        print("mellow daemon listening on " + self.address, file=sys.stderr)
+        # SIGTERM (and ^C) stop the daemon and remove its socket.
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        try:
+            async with server:
+                await server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            sys.stdout = sys.stdout.stream
+            self.io.shutdown()
+            if os.path.exists(self.address):
+                os.unlink(self.address)
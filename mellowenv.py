@@ -1,8 +1,169 @@
-class Environment:
+from mellowio import IOPool
+import asyncio
+import os
+import inspect
+
+class Undefined:
+    def __repr__(self):
+        return 'UNDEFINED'
+
+# Marks a slot that has not been assigned yet; 0, "" and None are values.
+UNDEFINED = Undefined()
+
+# Released frames kept for reuse, per frame size.
+FRAME_POOL_SIZE = 64
+
+# What a hook can be registered for, and the arguments it is called with:
+#   statement      (node, env)                 before each statement
+#   call           (node, args, env)           entering a Mellow function
+#   return         (node, value, env)          leaving it normally
+#   imported_call  (node, f, args, kwargs, env) before a Python call
+#   await          (node, env)                 before suspending
+#   resume         (node, value, env)          after the awaited result
+#   exception      (node, error, env)          once, at the innermost statement
+HOOK_EVENTS = ('statement', 'call', 'return', 'imported_call', 'await', 'resume', 'exception')
+
+# Callbacks an embedder registers to watch a script run. A program run with
+# any hook registered is instrumented first (see mellowhooks) and evaluated
+# by the tree walker; with none, nothing is instrumented and nothing is
+# checked while it runs.
+class Hooks:
     def __init__(self):
-        self.variables = dict()
-        self.functions = dict()
-        self.arguments = dict()
-        self.args = [[],[]]
+        self.callbacks = {event: [] for event in HOOK_EVENTS}
+
+    def add(self, event, callback=None):
+        # Also usable as a decorator: @env.hooks.add('call')
+        if event not in self.callbacks:
+            raise ValueError("unknown hook event: " + repr(event))
+        if callback is None:
+            return lambda callback: self.add(event, callback)
+        self.callbacks[event].append(callback)
+        return callback
+
+    def remove(self, event, callback):
+        self.callbacks[event].remove(callback)
+
+    def fire(self, event, *args):
+        for callback in self.callbacks[event]:
+            callback(*args)
+
+    def __bool__(self):
+        return any(self.callbacks.values())
+
+class Functions(dict):
+    # Mellow functions by name. Compiled code (see mellowcompiler) indexes
+    # it directly, and a name not defined yet fails as in the tree walker.
+    def __missing__(self, name):
+        raise NameError(name + " is not yet defined")
+
+class Environment:
+    def __init__(self, io_workers=None):
+        self.root = self
+        self.globals = []
+        self.names = dict()
+        # Top-level code runs with the globals as its local frame.
+        self.locals = self.globals
+        self.functions = Functions()
         self.imports = dict()
         self.decorators = dict()
+        # mellowmemo.Memo of each @mellow.memoize function, by name.
+        self.memos = dict()
+        # Released call frames by size, and a blank slot list per size to
+        # reset them with.
+        self.pools = dict()
+        self.blanks = dict()
+        # Spawned tasks that have not finished yet.
+        self.tasks = set()
+        # Files opened by the script and not closed yet.
+        self.files = set()
+        self.io = IOPool(io_workers)
+        # Directory relative paths in the script are opened from; None for
+        # the process's own working directory.
+        self.cwd = None
+        self.hooks = Hooks()
+
+    def bind(self, names):
+        # Lays out the global frame for a resolved program.
+        self.names = {name: slot for slot, name in enumerate(names)}
+        self.globals[:] = [UNDEFINED] * len(names)
+        return self
+
+    def extend(self, names):
+        # Lays out globals declared since the last bind or extend, keeping
+        # the values already there.
+        for name in names[len(self.globals):]:
+            self.names[name] = len(self.globals)
+            self.globals.append(UNDEFINED)
+        return self
+
+    def get(self, name, default=None):
+        slot = self.root.names.get(name)
+        if slot is None or self.globals[slot] is UNDEFINED:
+            return default
+        return self.globals[slot]
+
+    def spawn(self, awaitable, name=None):
+        if inspect.isawaitable(awaitable):
+            task = asyncio.ensure_future(awaitable)
+            if name is not None and isinstance(task, asyncio.Task):
+                task.set_name(name)
+        else:
+            # Spawning a plain imported call still hands back something to
+            # await, already holding its result.
+            task = asyncio.get_running_loop().create_future()
+            task.set_result(awaitable)
+        tasks = self.root.tasks
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        return task
+
+    async def join(self):
+        # Waits for everything spawned so far, including tasks spawned by
+        # those tasks, and raises the first error.
+        tasks = self.root.tasks
+        while tasks:
+            await asyncio.gather(*list(tasks))
+
+    def resolve_path(self, path):
+        if self.cwd is None:
+            return path
+        return os.path.join(self.cwd, path)
+
+    def close_files(self):
+        for f in list(self.root.files):
+            f.close()
+
+    def new_frame(self, size):
+        pool = self.root.pools.get(size)
+        if pool:
+            return pool.pop()
+        return Frame(self.root, size)
+
+    def release(self, frame):
+        root = self.root
+        size = len(frame.locals)
+        pool = root.pools.setdefault(size, [])
+        if len(pool) < FRAME_POOL_SIZE:
+            blank = root.blanks.get(size)
+            if blank is None:
+                blank = root.blanks[size] = [UNDEFINED] * size
+            frame.locals[:] = blank
+            pool.append(frame)
+
+class Frame:
+    # The environment seen by a function body: shared tables from the root
+    # environment plus its own list of parameter and local slots.
+    __slots__ = ('root', 'globals', 'locals', 'functions', 'imports', 'decorators')
+
+    def __init__(self, root, size):
+        self.root = root
+        self.globals = root.globals
+        self.locals = [UNDEFINED] * size
+        self.functions = root.functions
+        self.imports = root.imports
+        self.decorators = root.decorators
+
+    get = Environment.get
+    spawn = Environment.spawn
+    new_frame = Environment.new_frame
+    release = Environment.release
@@ -0,0 +1,167 @@
+from mellowast import *
+from mellowanalysis import SUSPENDS
+
+class Hooked(Node):
+    # A node standing in for `node` in an instrumented tree. It runs the
+    # node and fires env.root.hooks around it.
+    __slots__ = ()
+
+    def __init__(self, node):
+        setattr(self, self.fields[0], node)
+        self.sync = node.sync
+        self.lineno, self.colno = node.lineno, node.colno
+
+class HookStatement(Hooked):
+    __slots__ = fields = ('statement',)
+
+    def raised(self, error, env):
+        # Statements enclosing the one that raised see the same error; only
+        # the first, innermost one reports it.
+        if isinstance(error, FunctionReturn) or getattr(error, 'mellow_node', None) is not None:
+            return
+        try:
+            error.mellow_node = self.statement
+        except AttributeError:
+            pass
+        env.root.hooks.fire('exception', self.statement, error, env)
+
+    async def eval(self, env):
+        statement = self.statement
+        env.root.hooks.fire('statement', statement, env)
+        try:
+            return statement.eval_sync(env) if statement.sync else await statement.eval(env)
+        except Exception as e:
+            self.raised(e, env)
+            raise
+
+    def eval_sync(self, env):
+        statement = self.statement
+        env.root.hooks.fire('statement', statement, env)
+        try:
+            return statement.eval_sync(env)
+        except Exception as e:
+            self.raised(e, env)
+            raise
+
+class HookCall(Hooked):
+    __slots__ = fields = ('call',)
+
+    async def eval(self, env):
+        call = self.call
+        args = []
+        if call.args:
+            for arg in call.args.statements:
+                args.append(arg.eval_sync(env) if arg.sync else await arg.eval(env))
+        body, frame = call.enter(env, args)
+        hooks = env.root.hooks
+        hooks.fire('call', call, args, env)
+        try:
+            value = body.eval_sync(frame) if body.sync else await body.eval(frame)
+        except FunctionReturn as r:
+            value = r.value
+        finally:
+            env.release(frame)
+        hooks.fire('return', call, value, env)
+        return value
+
+    def eval_sync(self, env):
+        call = self.call
+        args = [arg.eval_sync(env) for arg in call.args.statements] if call.args else []
+        body, frame = call.enter(env, args)
+        hooks = env.root.hooks
+        hooks.fire('call', call, args, env)
+        try:
+            value = body.eval_sync(frame)
+        except FunctionReturn as r:
+            value = r.value
+        finally:
+            env.release(frame)
+        hooks.fire('return', call, value, env)
+        return value
+
+class HookImportedCall(Hooked):
+    __slots__ = fields = ('call',)
+
+    async def eval(self, env):
+        call = self.call
+        f = call.callee(env)
+        args, kwargs = await call.arguments(env)
+        env.root.hooks.fire('imported_call', call, f, args, kwargs, env)
+        return f(*args, **kwargs)
+
+    def eval_sync(self, env):
+        call = self.call
+        f = call.callee(env)
+        positional, names, values = call.plan or call.make_plan()
+        args = [arg.eval_sync(env) for arg in positional]
+        kwargs = dict(zip(names, [value.eval_sync(env) for value in values]))
+        env.root.hooks.fire('imported_call', call, f, args, kwargs, env)
+        return f(*args, **kwargs)
+
+async def imported_call(call, env):
+    # The callable and arguments of an imported call that is awaited, run
+    # on the I/O pool or spawned, with imported_call fired for them.
+    f = call.callee(env)
+    args, kwargs = await call.arguments(env)
+    env.root.hooks.fire('imported_call', call, f, args, kwargs, env)
+    return f, args, kwargs
+
+# Fired around the whole expression: the node may or may not actually have
+# to wait for its result.
+class HookAwait(Hooked):
+    __slots__ = fields = ('node',)
+
+    async def eval(self, env):
+        node = self.node
+        hooks = env.root.hooks
+        hooks.fire('await', node, env)
+        if isinstance(node, Await):
+            f, args, kwargs = await imported_call(node, env)
+            value = await f(*args, **kwargs)
+        elif isinstance(node, Blocking):
+            f, args, kwargs = await imported_call(node.call, env)
+            value = await env.root.io.submit(f, *args, **kwargs)
+        elif isinstance(node, Spawn) and isinstance(node.call, Blocking):
+            f, args, kwargs = await imported_call(node.call.call, env)
+            value = env.spawn(env.root.io.submit(f, *args, **kwargs))
+        elif isinstance(node, Spawn) and isinstance(node.call, ImportedFunction):
+            f, args, kwargs = await imported_call(node.call, env)
+            value = env.spawn(f(*args, **kwargs))
+        else:
+            value = await node.eval(env)
+        hooks.fire('resume', node, value, env)
+        return value
+
+def instrument(node, wrap=True):
+    # Rewrites a prepared tree in place so it fires hooks as it runs, and
+    # returns the node to use in place of `node`. Running it again on an
+    # instrumented tree changes nothing. The call under spawn or blocking
+    # is left alone, since those nodes take it apart themselves, and so is
+    # the Open of open("x").read(), which Read turns into one trip to the
+    # I/O pool; the hooks fire around the spawn, blocking or Read instead.
+    keep = isinstance(node, Hooked)
+    inner = not (keep or isinstance(node, (Spawn, Blocking))
+                 or isinstance(node, Read) and isinstance(node.file, Open))
+    for field in node.fields:
+        value = getattr(node, field)
+        if isinstance(value, list):
+            value[:] = [instrument(v, inner) for v in value]
+        elif isinstance(value, dict):
+            items = [(instrument(k, inner) if isinstance(k, Node) else k,
+                      instrument(v, inner)) for k, v in value.items()]
+            value.clear()
+            value.update(items)
+        elif isinstance(value, Node):
+            setattr(node, field, instrument(value, inner))
+    if isinstance(node, (Program, Block)):
+        node.statements[:] = [s if isinstance(s, HookStatement) else HookStatement(s)
+                              for s in node.statements]
+    if not wrap or keep:
+        return node
+    if isinstance(node, Function):
+        return HookCall(node)
+    if isinstance(node, ImportedFunction):
+        return HookImportedCall(node)
+    if isinstance(node, (Spawn,) + SUSPENDS):
+        return HookAwait(node)
+    return node
@@ -0,0 +1,65 @@
+import importlib
+import importlib.util
+
+# Namespaces by dotted name, shared by every Import that names them, so
+# running an import again reuses the binding and the attributes already
+# looked up.
+MODULES = {}
+
+class Namespace:
+    # Stands in for a module, or anything pulled in with `from x import y`,
+    # in env.imports. A module is only imported on first use, and each
+    # attribute is fetched from it once.
+    def __init__(self, name, load=None, target=None):
+        self.name = name
+        self.load = load
+        self.target = target
+        self.attrs = {}
+
+    def __repr__(self):
+        state = 'lazy ' if self.load is not None else ''
+        return '<%snamespace %r>' % (state, self.name)
+
+    def resolve(self):
+        if self.load is not None:
+            self.target = self.load()
+            self.load = None
+        return self.target
+
+    def get(self, name, default=None):
+        try:
+            return self.attrs[name]
+        except KeyError:
+            pass
+        try:
+            value = getattr(self.resolve(), name)
+        except AttributeError:
+            return default
+        self.attrs[name] = value
+        return value
+
+def import_module(name):
+    namespace = MODULES.get(name)
+    if namespace is None:
+        # Finding the module is cheap next to running it, and still makes
+        # `import missing` fail on its own line.
+        try:
+            found = importlib.util.find_spec(name) is not None
+        except ValueError:
+            found = True
+        if not found:
+            raise ModuleNotFoundError("No module named %r" % name, name=name)
+        namespace = MODULES[name] = Namespace(name, lambda: importlib.import_module(name))
+    return namespace
+
+def import_from(package, name):
+    key = package + '.' + name
+    namespace = MODULES.get(key)
+    if namespace is None:
+        module = import_module(package).resolve()
+        try:
+            value = getattr(module, name)
+        except AttributeError:
+            value = importlib.import_module('.' + name, package)
+        namespace = MODULES[key] = Namespace(key, target=value)
+    return namespace
@@ -0,0 +1,193 @@
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import functools
+import itertools
+import threading
+import asyncio
+import mmap
+import os
+
+# Size of the pieces f.chunks() hands out when no size is given.
+CHUNK_SIZE = 1 << 16
+
+# Lines read per trip to the I/O pool when a for loop iterates a file.
+LINE_BATCH = 512
+
+def default_workers():
+    workers = os.environ.get('MELLOW_IO_THREADS')
+    if workers is not None:
+        return int(workers)
+    return min(32, (os.cpu_count() or 1) + 4)
+
+def slurp(path):
+    with open(path) as f:
+        return f.read()
+
+# What open("path") evaluates to. The file can be read whole, streamed a line
+# or a chunk at a time, or memory-mapped. It is closed as soon as a stream
+# over it runs out, and whatever is still open is closed when the script
+# ends.
+class File:
+    def __init__(self, path, files=None):
+        self.path = path
+        self.handle = open(path)
+        self.mapped = None
+        self.files = files
+        if files is not None:
+            files.add(self)
+
+    def __repr__(self):
+        state = 'closed' if self.closed else 'open'
+        return '<%s file %r>' % (state, self.path)
+
+    @property
+    def closed(self):
+        return self.handle.closed
+
+    def read(self):
+        return self.handle.read()
+
+    def lines(self):
+        # Lines come without their trailing newline.
+        try:
+            for line in self.handle:
+                yield line[:-1] if line.endswith('\n') else line
+        finally:
+            self.close()
+
+    def batch(self, size=LINE_BATCH):
+        # The next size lines, as lines() gives them; [] at the end of the
+        # file, which closes it.
+        lines = []
+        for line in itertools.islice(self.handle, size):
+            lines.append(line[:-1] if line.endswith('\n') else line)
+        if not lines:
+            self.close()
+        return lines
+
+    def chunks(self, size=CHUNK_SIZE):
+        try:
+            while True:
+                chunk = self.handle.read(size)
+                if not chunk:
+                    return
+                yield chunk
+        finally:
+            self.close()
+
+    def map(self):
+        # Read-only bytes backed by the page cache; slicing copies only the
+        # slice. Empty files cannot be mapped and give b''.
+        if self.mapped is None:
+            fileno = self.handle.fileno()
+            if os.fstat(fileno).st_size == 0:
+                return b''
+            self.mapped = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+        return self.mapped
+
+    def close(self):
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+        self.handle.close()
+        if self.files is not None:
+            self.files.discard(self)
+
+    __iter__ = lines
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# A file's lines for a for loop running on the event loop. Iterating gives
+# the lines read so far and stops; refill() reads the next batch on the I/O
+# pool and says whether there was one.
+class Lines:
+    __slots__ = ('file', 'buffer')
+
+    def __init__(self, file):
+        self.file = file
+        self.buffer = iter(())
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.buffer)
+
+    async def refill(self, io):
+        lines = await io.run(self.file.batch)
+        self.buffer = iter(lines)
+        return bool(lines)
+
+# Runs blocking work (file access and imported calls marked `blocking`) on
+# a bounded thread pool so the event loop keeps serving other coroutines.
+# With no workers the work runs inline on the loop, as it used to.
+class IOPool:
+    def __init__(self, workers=None):
+        self.workers = default_workers() if workers is None else workers
+        self.executor = None
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.started = 0
+        self.completed = 0
+        self.max_queued = 0
+
+    @property
+    def queued(self):
+        return self.submitted - self.started
+
+    @property
+    def running(self):
+        return self.started - self.completed
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'submitted': self.submitted,
+            'queued': self.queued,
+            'running': self.running,
+            'completed': self.completed,
+            'max_queued': self.max_queued,
+        }
+
+    def submit(self, func, *args, **kwargs):
+        # Returns a future for func(*args, **kwargs).
+        loop = asyncio.get_running_loop()
+        if kwargs:
+            func = functools.partial(func, **kwargs)
+        if not self.workers:
+            future = loop.create_future()
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix='mellow-io')
+        with self.lock:
+            self.submitted += 1
+            self.max_queued = max(self.max_queued, self.submitted - self.started)
+        # The job sees the caller's context variables, such as the daemon's
+        # per-request output.
+        context = contextvars.copy_context()
+        return loop.run_in_executor(self.executor, context.run, self.job, func, args)
+
+    async def run(self, func, *args, **kwargs):
+        return await self.submit(func, *args, **kwargs)
+
+    def job(self, func, args):
+        with self.lock:
+            self.started += 1
+        try:
+            return func(*args)
+        finally:
+            with self.lock:
+                self.completed += 1
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
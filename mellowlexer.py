@@ -1,80 +1,244 @@
-from rply import LexerGenerator
+from rply import LexingError
+from rply.token import Token, SourcePosition
+from array import array
+from bisect import bisect_right
+from sys import intern
 import re
 
+NEWLINES = re.compile('\n')
+
+class SourceLexingError(LexingError):
+    # rply's LexingError, printed as its message.
+    def __str__(self):
+        return self.message
+
+# Where each line of a script starts, for turning token offsets into line
+# and column numbers and quoting the line in error messages. The offsets
+# are only collected the first time they are needed.
+class SourceMap:
+    def __init__(self, text, name='<script>'):
+        self.text = text
+        self.name = name
+        self.starts = None
+
+    def line_starts(self):
+        if self.starts is None:
+            self.starts = array('q', [0])
+            self.starts.extend(m.end() for m in NEWLINES.finditer(self.text))
+        return self.starts
+
+    def position(self, offset):
+        starts = self.line_starts()
+        lineno = bisect_right(starts, offset)
+        return lineno, offset - starts[lineno - 1] + 1
+
+    def line(self, lineno):
+        starts = self.line_starts()
+        if not 1 <= lineno <= len(starts):
+            return ''
+        end = starts[lineno] - 1 if lineno < len(starts) else len(self.text)
+        return self.text[starts[lineno - 1]:end]
+
+    def excerpt(self, offset):
+        # The line holding offset with a caret under it.
+        lineno, colno = self.position(offset)
+        line = self.line(lineno).rstrip('\r')
+        return '%s, line %d:%d\n    %s\n    %s^' % (self.name, lineno, colno, line.expandtabs(1),
+                                                   ' ' * (colno - 1))
+
+# A token as offsets into the source it was lexed from. Its text and its
+# SourcePosition are only built when a production asks for them, so the
+# punctuation, newlines and operators that make up most tokens never get a
+# string of their own.
+class Span(Token):
+    __slots__ = ('name', 'start', 'end', 'lineno', 'colno', 'source', 'text')
+
+    def __init__(self, name, start, end, lineno, colno, source, text=None):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.lineno = lineno
+        self.colno = colno
+        self.source = source
+        self.text = text
+
+    @property
+    def value(self):
+        if self.text is None:
+            self.text = self.source.text[self.start:self.end]
+        return self.text
+
+    @property
+    def source_pos(self):
+        return SourcePosition(self.start, self.lineno, self.colno)
+
+    def __repr__(self):
+        return "Span(%r, %r)" % (self.name, self.value)
+
 class Lexer:
-    def __init__(self):
-        self.lexer = LexerGenerator()
-
-    def _add_tokens(self):
-        self.lexer.add('STRING', r'(""".*?""")|(".*?")|(\'.*?\')')
-        self.lexer.add('PRINT', r'print')
-        self.lexer.add('END', r'end')
-        self.lexer.add('open', r'open')
-        self.lexer.add('read', r'read')
-        self.lexer.add('return', r'return')
-        self.lexer.add('from', r'from')
-        self.lexer.add('import', r'import')
-        self.lexer.add('AND', r'AND')
-        self.lexer.add('await', r'await')
-        self.lexer.add('@', r'@')
-        self.lexer.add('{', r'{')
-        self.lexer.add('}', r'}')
-        self.lexer.add('[', r'\[')
-        self.lexer.add(']', r'\]')
-        self.lexer.add(',', r',')
-        self.lexer.add('.', r'\.')
-        self.lexer.add('(', r'\(')
-        self.lexer.add(')', r'\)')
-        self.lexer.add('SUM', r'\+')
-        self.lexer.add('SUB', r'\-')
-        self.lexer.add('MUL', r'\*')
-        self.lexer.add("DIV", r'\/')
-        self.lexer.add('NUMBER', r'\d+')
-        self.lexer.add('IF', r'if')
-        self.lexer.add('ELSE', r'else')
-        self.lexer.add('ELIF', r'elif')
-        self.lexer.add('DEF', r'def')
-        self.lexer.add('IDENTIFIER', r'[a-zA-Z_][a-zA-Z0-9_]*')  
-        self.lexer.add('SLEEP', r'sleep')   
-        self.lexer.add('NEWLINE', r'\\n')
-        self.lexer.add('COLON', r':')
-        self.lexer.add('==', r'==')
-        self.lexer.add('!=', r'!=')
-        self.lexer.add('>=', r'>=')
-        self.lexer.add('<=', r'<=')
-        self.lexer.add('>', r'>')
-        self.lexer.add('<', r'<')
-        self.lexer.add('=', r'=')
-        self.lexer.ignore(r'\s+')
-
-    def lex(self, source):
-        self._add_tokens()
-        lexer = self.lexer.build()
-        comments = r'#[^\\n]*(?:\\n|\Z|\\n)'
-        comment = re.search(comments,source)
-        commented = False
-        while comment is not None:
-            commented = True
-            start, end = comment.span(0)
-            assert start >= 0 and end >= 0
-            source = source[0:start] + source[end:]
-            comment = re.search(comments,source)
-        try:
-            lex = lexer.lex(source)
-            if commented:
-                for t in lex:
-                    t.value
-        except:
-            source = source.replace('\\n', '\n')
-            comments = r'#[^\n]*'
-            comment = re.search(comments,source)
-            while comment is not None:
-                start, end = comment.span(0)
-                assert start >= 0 and end >= 0
-                source = source[0:start] + source[end:]
-                comment = re.search(comments,source)
-            source = source.replace('\n', '\\n')
-            return lexer.lex(source)
-        else:
-            return lex
+    # Reserved words are lexed as IDENTIFIER and then renamed through this
+    # table, so "printer" or "endpoint" stay identifiers.
+    keywords = {
+        'print': 'PRINT',
+        'end': 'END',
+        'open': 'open',
+        'read': 'read',
+        'return': 'return',
+        'from': 'from',
+        'import': 'import',
+        'AND': 'AND',
+        'await': 'await',
+        'if': 'IF',
+        'else': 'ELSE',
+        'elif': 'ELIF',
+        'def': 'DEF',
+        'while': 'WHILE',
+        'for': 'FOR',
+        'in': 'IN',
+        'sleep': 'SLEEP',
+    }
+
+    # Words that are only keywords where an identifier could not be: spawn
+    # and blocking when a call follows them, gather when its ( does. Scripts
+    # that use them as variable or function names keep working. A script
+    # that defines a function named after one of them calls that function
+    # instead: there the word is never a keyword.
+    contextual = {
+        'spawn': re.compile(r'[ \t]*[a-zA-Z_]'),
+        'blocking': re.compile(r'[ \t]*[a-zA-Z_]'),
+        'gather': re.compile(r'[ \t]*\('),
+    }
+    _defined = re.compile(r'\bdef[ \t]+(%s)\b' % '|'.join(contextual))
+
+    rules = [
+        ('STRING', r'"""[\s\S]*?"""|".*?"|\'.*?\''),
+        ('NEWLINE', r'\n'),
+        ('NUMBER', r'\d+'),
+        ('IDENTIFIER', r'[a-zA-Z_][a-zA-Z0-9_]*'),
+        ('@', r'@'),
+        ('{', r'{'),
+        ('}', r'}'),
+        ('[', r'\['),
+        (']', r'\]'),
+        (',', r','),
+        ('.', r'\.'),
+        ('(', r'\('),
+        (')', r'\)'),
+        ('SUM', r'\+'),
+        ('SUB', r'\-'),
+        ('MUL', r'\*'),
+        ('DIV', r'\/'),
+        ('COLON', r':'),
+        ('==', r'=='),
+        ('!=', r'!='),
+        ('>=', r'>='),
+        ('<=', r'<='),
+        ('>', r'>'),
+        ('<', r'<'),
+        ('=', r'='),
+    ]
+
+    # Whitespace other than newlines, and comments. A comment runs up to
+    # the newline, which is left in place so the statement still ends.
+    ignore = r'[ \t\r\f\v]+|#[^\n]*'
+
+    # Built once per process: every rule is one alternative of a single
+    # pattern and the group index tells which rule matched.
+    _names = [None] + [name for name, _ in rules]
+    _master = re.compile(
+        '|'.join('(%s)' % pattern for _, pattern in rules)
+    )
+    _skip = re.compile('(?:%s)+' % ignore)
+
+    # Tokens that open and close a construct a top-level statement cannot
+    # end inside.
+    openers = {'IF', 'WHILE', 'FOR', 'DEF', '(', '{', '['}
+    closers = {'END', ')', '}', ']'}
+
+    def lex(self, source, name='<script>'):
+        # source is the script's text as read, real newlines and all.
+        return self._tokens(SourceMap(source, name))
+
+    def statements(self, source, name='<script>'):
+        # The tokens of one top-level statement at a time, split at the
+        # newlines outside any if/def ... end or brackets. A decorator line
+        # stays with the def that follows it.
+        openers = self.openers
+        closers = self.closers
+        chunk = []
+        depth = 0
+        decorated = False
+        for token in self._tokens(SourceMap(source, name)):
+            name = token.name
+            if not chunk:
+                decorated = name == '@'
+            chunk.append(token)
+            if name in openers:
+                depth += 1
+                if name == 'DEF':
+                    decorated = False
+            elif name in closers:
+                depth -= 1
+            elif name == 'NEWLINE' and depth == 0 and not decorated:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
 
+    def _tokens(self, sourcemap):
+        source = sourcemap.text
+        master = self._master.match
+        skip = self._skip.match
+        names = self._names
+        keywords = self.keywords
+        contextual = self.contextual
+        defined = set(self._defined.findall(source))
+        if defined:
+            contextual = {word: follows for word, follows in contextual.items()
+                          if word not in defined}
+        idx = 0
+        end = len(source)
+        lineno = 1
+        line_start = 0
+        last = 'NEWLINE'
+        while True:
+            m = skip(source, idx)
+            if m is not None:
+                idx = m.end()
+            if idx >= end:
+                return
+            m = master(source, idx)
+            if m is None:
+                raise SourceLexingError("unexpected character\n" + sourcemap.excerpt(idx),
+                                        SourcePosition(idx, *sourcemap.position(idx)))
+            name = names[m.lastindex]
+            start = idx
+            line = lineno
+            colno = start - line_start + 1
+            idx = m.end()
+            text = None
+            if name == 'IDENTIFIER':
+                # Interned, so every node naming the same variable or
+                # function shares one string.
+                text = intern(m.group())
+                if last != '.' or text == 'read':
+                    # Attribute names such as asyncio.sleep stay identifiers;
+                    # only .read() has its own production.
+                    name = keywords.get(text, name)
+                    if text in contextual and last != 'DEF' and contextual[text].match(source, idx):
+                        name = text
+            elif name == 'NEWLINE':
+                lineno += 1
+                line_start = idx
+                # Blank and comment-only lines collapse into the previous
+                # NEWLINE; the grammar has no empty statement.
+                if last == 'NEWLINE':
+                    continue
+            elif name == 'STRING' and source[start] == source[start + 1]:
+                # A triple-quoted string may span lines.
+                lines = source.count('\n', start, idx)
+                if lines:
+                    lineno += lines
+                    line_start = source.rindex('\n', start, idx) + 1
+            last = name
+            yield Span(name, start, idx, line, colno, sourcemap, text)
@@ -0,0 +1,139 @@
+from mellowenv import Environment
+from mellowoptimizer import Optimizer
+from mellowresolver import Resolver
+from mellowanalysis import mark_sync, StreamAnalysis
+from mellowcompiler import Compiler
+from mellowvm import VM
+import mellowcache
+import time
+
+# Turns a script path into a resolved, analysed Program, through the .mlwc
+# cache when it is enabled, and runs programs on either engine.
+class Loader:
+    def __init__(self, optimize=1, cache=True, timings=None):
+        self.optimize = optimize
+        self.cache = cache
+        # A list to append (phase, seconds) to, or None when not reporting.
+        self.timings = timings
+        self.lexer = None
+        self.parser = None
+        # A mellowprofile.Profiler to show the programs to, or None. Profiled
+        # programs run on the tree walker, which it times node by node.
+        self.profiler = None
+
+    def timed(self, name, func, *args):
+        if self.timings is None:
+            return func(*args)
+        start = time.perf_counter()
+        result = func(*args)
+        self.timings.append((name, time.perf_counter() - start))
+        return result
+
+    def get_parser(self):
+        if self.parser is None:
+            # rply is only imported once a script actually has to be parsed.
+            from mellowlexer import Lexer
+            from mellowparser import Parser
+            self.lexer = Lexer()
+            self.parser = self.timed('table load', Parser().get_parser)
+        return self.parser
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def load(self, path):
+        return self.load_source(path, self.read(path))
+
+    def load_source(self, path, source):
+        program = None
+        if self.cache:
+            program = self.timed('cache load', mellowcache.load, path, source, self.optimize)
+        if program is None:
+            program = self.compile_source(source, path)
+            if self.cache:
+                self.timed('cache store', mellowcache.store, path, source, self.optimize, program)
+        return program
+
+    def compile_source(self, source, name='<script>'):
+        parser = self.get_parser()
+        tokens = self.lexer.lex(source, name)
+        if self.timings is not None:
+            tokens = iter(self.timed('lex', list, tokens))
+        program = self.timed('parse', parser.parse, tokens, Environment())
+        if self.optimize:
+            program = self.timed('optimize', Optimizer().optimize, program)
+        self.timed('resolve', Resolver().resolve_program, program)
+        self.timed('analyse', mark_sync, program)
+        return program
+
+    def instrument(self, program, env):
+        # Hooked programs run on the tree walker, instrumented to call them.
+        from mellowhooks import instrument
+        instrument(program)
+
+    async def run(self, program, env, engine='vm'):
+        env.bind(program.global_names)
+        if env.hooks:
+            self.instrument(program, env)
+            engine = 'ast'
+        if self.profiler is not None:
+            self.profiler.watch(program)
+            engine = 'ast'
+        if engine == 'vm':
+            code = self.timed('compile', Compiler().compile_program, program)
+        start = time.perf_counter()
+        try:
+            if engine == 'vm':
+                result = await VM().run(code, env)
+            else:
+                result = program.eval_sync(env) if program.sync else await program.eval(env)
+            # The script is done once the tasks it spawned are.
+            await env.join()
+            return result
+        finally:
+            env.close_files()
+            if self.timings is not None:
+                self.timings.append(('eval', time.perf_counter() - start))
+
+    async def stream(self, path, env, engine='vm'):
+        # Parses, prepares and runs one top-level statement at a time: the
+        # script starts before it is all parsed, and only the statement
+        # being run (plus function definitions) is kept. No .mlwc is used.
+        parser = self.get_parser()
+        text = self.read(path)
+        state = Environment()
+        optimizer = Optimizer()
+        resolver = Resolver()
+        analysis = StreamAnalysis()
+        compiler = Compiler()
+        result = None
+        start = time.perf_counter()
+        try:
+            for tokens in self.lexer.statements(text, path):
+                program = parser.parse(iter(tokens), state)
+                if self.optimize:
+                    program = optimizer.optimize(program)
+                resolver.resolve_program(program)
+                analysis.mark(program)
+                if analysis.remarked:
+                    compiler.reset(analysis.definitions)
+                env.extend(program.global_names)
+                if env.hooks:
+                    self.instrument(program, env)
+                    engine = 'ast'
+                if self.profiler is not None:
+                    self.profiler.watch(program)
+                    engine = 'ast'
+                if engine == 'vm':
+                    result = await VM().run(compiler.compile_program(program), env)
+                elif program.sync:
+                    result = program.eval_sync(env)
+                else:
+                    result = await program.eval(env)
+            await env.join()
+            return result
+        finally:
+            env.close_files()
+            if self.timings is not None:
+                self.timings.append(('stream', time.perf_counter() - start))
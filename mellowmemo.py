@@ -0,0 +1,57 @@
+from collections import OrderedDict
+
+# Returned by Memo.get when the arguments have not been seen.
+MISSING = object()
+
+# Results of one @mellow.memoize function, keyed by its argument values and
+# evicted least recently used first once there are maxsize of them
+# (maxsize 0 keeps everything).
+class Memo:
+    def __init__(self, name, maxsize=128):
+        if type(maxsize) is not int or maxsize < 0:
+            raise ValueError("memoize maxsize must be a whole number, not %r" % (maxsize,))
+        self.name = name
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Calls with an argument that cannot be a dict key (an array, a
+        # dict), which are run without caching.
+        self.uncached = 0
+
+    def key(self, locals, params):
+        key = tuple(locals[:params])
+        try:
+            hash(key)
+        except TypeError:
+            self.uncached += 1
+            return None
+        return key
+
+    def get(self, key):
+        value = self.cache.get(key, MISSING)
+        if value is MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+            if self.maxsize:
+                self.cache.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        cache = self.cache
+        cache[key] = value
+        if self.maxsize and len(cache) > self.maxsize:
+            cache.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'uncached': self.uncached,
+            'evictions': self.evictions,
+            'size': len(self.cache),
+            'maxsize': self.maxsize,
+        }
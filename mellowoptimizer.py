@@ -0,0 +1,108 @@
+from mellowast import *
+
+LITERALS = (Number, String, Boolean, Constant)
+
+# Folded strings longer than this stay as expressions, so "x" * 100000000
+# is not built at compile time.
+MAX_FOLDED_LENGTH = 4096
+
+# Rewrites a parsed Program in place before it is resolved: arithmetic and
+# comparisons on literals are folded into Constant nodes, list and dict
+# literals of constants get a template each evaluation copies (a Constant
+# would hand every evaluation the same mutable value),
+# if/elif branches with a constant condition are replaced by the branch that
+# runs, and while loops that never run and statements after a return are
+# dropped.
+class Optimizer:
+    def __init__(self):
+        self.methods = {}
+
+    def optimize(self, node):
+        for field in node.fields:
+            value = getattr(node, field)
+            if isinstance(value, list):
+                value[:] = [self.optimize(v) for v in value]
+            elif isinstance(value, dict):
+                items = [(self.optimize(k) if isinstance(k, Node) else k, self.optimize(v))
+                         for k, v in value.items()]
+                value.clear()
+                value.update(items)
+            elif isinstance(value, Node):
+                setattr(node, field, self.optimize(value))
+        kind = type(node)
+        method = self.methods.get(kind, self)
+        if method is self:
+            method = self.methods[kind] = getattr(self, 'optimize_' + kind.__name__, None)
+        if method is None:
+            return node
+        return method(node)
+
+    def optimize_BinaryOp(self, node):
+        if not (isinstance(node.left, LITERALS) and isinstance(node.right, LITERALS)):
+            return node
+        try:
+            value = node.apply(node.left.value, node.right.value)
+        except Exception:
+            # Leave 1 / 0 and friends to fail at run time, where they did.
+            return node
+        if isinstance(value, str) and len(value) > MAX_FOLDED_LENGTH:
+            return node
+        folded = Constant(value)
+        folded.lineno, folded.colno = node.lineno, node.colno
+        return folded
+
+    optimize_Sum = optimize_Sub = optimize_Mul = optimize_Div = optimize_BinaryOp
+    optimize_Equal = optimize_NotEqual = optimize_BinaryOp
+    optimize_GreaterThan = optimize_LessThan = optimize_BinaryOp
+    optimize_GreaterThanEqual = optimize_LessThanEqual = optimize_BinaryOp
+
+    def optimize_Array(self, node):
+        if all(isinstance(v, LITERALS) for v in node.statements):
+            node.template = tuple(v.value for v in node.statements)
+        return node
+
+    def optimize_Dict(self, node):
+        if not all(isinstance(k, LITERALS) for k in node.data):
+            return node
+        keys = [k.value for k in node.data]
+        try:
+            template = dict.fromkeys(keys)
+        except TypeError:
+            # An unhashable key fails when the literal is evaluated.
+            return node
+        if all(isinstance(v, LITERALS) for v in node.data.values()):
+            node.keys, node.template = (), dict(zip(keys, [v.value for v in node.data.values()]))
+            return node
+        node.keys, node.template = tuple(keys), template
+        return node
+
+    def optimize_If(self, node):
+        if node.elif_condition is not None and isinstance(node.elif_condition, LITERALS):
+            if node.elif_condition.value:
+                node.else_body = node.elif_body
+            node.elif_condition = node.elif_body = None
+        if not isinstance(node.condition, LITERALS):
+            return node
+        if node.condition.value:
+            return node.body
+        if node.elif_condition is not None and node.elif_body is not None:
+            node.condition, node.body = node.elif_condition, node.elif_body
+            node.elif_condition = node.elif_body = None
+            return node
+        if node.else_body is not None:
+            return node.else_body
+        return Constant(None)
+
+    def optimize_While(self, node):
+        if not isinstance(node.condition, LITERALS) or node.condition.value:
+            return node
+        folded = Constant(None)
+        folded.lineno, folded.colno = node.lineno, node.colno
+        return folded
+
+    def optimize_Block(self, node):
+        for i, statement in enumerate(node.statements):
+            if isinstance(statement, Return):
+                del node.statements[i + 1:]
+                break
+        return node
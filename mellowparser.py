@@ -1,5 +1,24 @@
 from rply import ParserGenerator
+from rply.errors import ParserGeneratorWarning
+from rply.grammar import Grammar
+from rply.parser import LRParser
+from rply.parsergenerator import LRTable
+from rply.token import Token
 from mellowast import *
+from mellowcache import cache_dir
+from mellowlexer import Span
+import tempfile
+import warnings
+import json
+import sys
+import os
+
+# Tables shipped next to the interpreter (or inside the PyInstaller bundle)
+# are tried before the per-user cache.
+FROZEN_TABLES = os.path.join(
+    getattr(sys, '_MEIPASS', os.path.dirname(os.path.abspath(__file__))),
+    'mellowtables'
+)
 
 class Parser:
     def __init__(self):
@@ -10,7 +29,8 @@ class Parser:
             '$end', 'IF','==', '!=', '>=', '<=', '<', '>',
             'COLON', 'ELSE', 'ELIF', 'DEF', 'END', 'SLEEP',
             ',', 'open', 'read', '.', 'return', 'import',
-            '{', '}', 'AND', 'await', '@', 'from', '[', ']'
+            '{', '}', 'AND', 'await', '@', 'from', '[', ']',
+            'spawn', 'gather', 'blocking', 'WHILE', 'FOR', 'IN'
             ],
             precedence=[
                 ('left', ['SUM', 'SUB']),
@@ -33,15 +53,12 @@ class Parser:
         def program_statement(env, p):
             return Program(p[0])
 
-        @self.pg.production('program : statement_full program')
+        @self.pg.production('program : program statement_full')
         def program_statement_program(env, p):
-            if type(p[1]) is Program:
-                program = p[1]
-            else:
-                program = Program(p[-1])
-            
-            program.add_statement(p[0])
-            return p[1]
+            # Left recursive, so the parser stack stays flat however long
+            # the script is.
+            p[0].add_statement(p[1])
+            return p[0]
 
         @self.pg.production('statement_full : statement NEWLINE')
         @self.pg.production('statement_full : statement $end')
@@ -68,15 +85,15 @@ class Parser:
 
         @self.pg.production('expression : IDENTIFIER [ expression ]')
         def index(env, p):
-            return Index(Variable(p[0].value),p[2].value)
+            return Index(Variable(p[0].value), p[2])
             
         @self.pg.production('statement : PRINT ( expression )')
         def printsw(env, p):
             return Print(p[2])
 
-        @self.pg.production('statement : SLEEP ( NUMBER )')
+        @self.pg.production('statement : SLEEP ( expression )')
         def sleep(env, p):
-            return Sleep(int(p[2].value))
+            return Sleep(p[2])
 
         @self.pg.production('expression : NUMBER')
         def number(env, p):
@@ -120,6 +137,14 @@ class Parser:
         def expression_if_elif_else(env, p):
             return If(condition=p[1], body=p[4], elif_condition=p[6], elif_body=p[9], else_body=p[13])
 
+        @self.pg.production('statement : WHILE expression COLON NEWLINE block END')
+        def statement_while(env, p):
+            return While(p[1], p[4])
+
+        @self.pg.production('statement : FOR IDENTIFIER IN expression COLON NEWLINE block END')
+        def statement_for(env, p):
+            return For(Variable(p[1].value), p[3], p[6])
+
         @self.pg.production('expression : expression != expression')
         @self.pg.production('expression : expression == expression')
         @self.pg.production('expression : expression >= expression')
@@ -150,15 +175,10 @@ class Parser:
         def block_expr(env, p):
             return Block(p[0])
 
-        @self.pg.production('block : statement_full block')
+        @self.pg.production('block : block statement_full')
         def block_expr_block(env, p):
-            if type(p[1]) is Block:
-                b = p[1]
-            else:
-                b = Block(p[1])
-            
-            b.add_statement(p[0])
-            return b
+            p[0].add_statement(p[1])
+            return p[0]
 
         @self.pg.production("function : IDENTIFIER ( )")
         def function_call(env, p):
@@ -166,9 +186,7 @@ class Parser:
 
         @self.pg.production("function : IDENTIFIER ( args )")
         def function_callargs(env, p):
-            have = list(p[2].statements)
-            env.args[1] = have
-            return Function(p[0].value, Array(p[2]))
+            return Function(p[0].value, Arguments(p[2]))
         
         @self.pg.production('function : IDENTIFIER . IDENTIFIER ( ) ')
         def importedfunc(env, p):
@@ -194,29 +212,50 @@ class Parser:
         def awaitfunction(env, p):
             return Await(p[1])
 
+        @self.pg.production('expression : await IDENTIFIER')
+        def awaitvalue(env, p):
+            return AwaitValue(Variable(p[1].value))
+
+        @self.pg.production('expression : spawn function')
+        def spawnfunction(env, p):
+            return Spawn(p[1])
+
+        @self.pg.production('expression : blocking function')
+        def blockingfunction(env, p):
+            return Blocking(p[1])
+
+        @self.pg.production('expression : spawn blocking function')
+        def spawnblocking(env, p):
+            return Spawn(Blocking(p[2]))
+
+        @self.pg.production('expression : gather ( )')
+        @self.pg.production('expression : gather ( args )')
+        def gather(env, p):
+            return Gather(p[2] if len(p) == 4 else InnerArray([]))
+
         @self.pg.production('funcstatement : defstatement ( ) COLON NEWLINE block END')
         def funcstate(env, p):
             return AssignmentFunction(p[0], p[5], None)
 
         @self.pg.production('statement : @ IDENTIFIER . IDENTIFIER NEWLINE funcstatement')
         def blank_deco(env, p ):
-            return DecoratedFunction(p[1].value, p[3].value, p[5], False, None, None)
+            return decorated(p[1].value, p[3].value, p[5], False, None, None)
 
         @self.pg.production('statement : @ IDENTIFIER . IDENTIFIER ( ) NEWLINE funcstatement')
         def none_deco(env, p ):
-            return DecoratedFunction(p[1].value, p[3].value, p[7], True, None, None)
+            return decorated(p[1].value, p[3].value, p[7], True, None, None)
 
         @self.pg.production('statement : @ IDENTIFIER . IDENTIFIER ( args AND kwargs ) NEWLINE funcstatement')
         def both_deco(env, p ):
-            return DecoratedFunction(p[1].value, p[3].value, p[10], True, p[5], p[7])
+            return decorated(p[1].value, p[3].value, p[10], True, p[5], p[7])
 
         @self.pg.production('statement : @ IDENTIFIER . IDENTIFIER ( kwargs ) NEWLINE funcstatement')
         def kwargs_deco(env, p ):
-            return DecoratedFunction(p[1].value, p[3].value, p[8], True, None, p[5])
+            return decorated(p[1].value, p[3].value, p[8], True, None, p[5])
 
         @self.pg.production('statement : @ IDENTIFIER . IDENTIFIER ( args ) NEWLINE funcstatement')
         def args_deco(env, p ):
-            return DecoratedFunction(p[1].value, p[3].value, p[8], True, p[5], None)
+            return decorated(p[1].value, p[3].value, p[8], True, p[5], None)
 
         @self.pg.production("defstatement : DEF IDENTIFIER")
         def defstatement(env, p):
@@ -228,8 +267,6 @@ class Parser:
 
         @self.pg.production("funcstatement : defstatement ( args ) COLON NEWLINE block END")
         def function_assign(env, p):
-            need = list(x.name for x in p[2].statements)
-            env.args[0] = need
             func = AssignmentFunction(p[0], p[6], Array(p[2]))
             return func
 
@@ -240,7 +277,7 @@ class Parser:
 
         @self.pg.production('args : IDENTIFIER , args')
         def arglist(env, p):
-            p[2].append(Variable(p[0].value))
+            p[2].prepend(Variable(p[0].value))
             return p[2]
 
         @self.pg.production('args : expression')
@@ -250,7 +287,7 @@ class Parser:
 
         @self.pg.production('args : expression , args')
         def arglist(env, p):
-            p[2].append(p[0])
+            p[2].prepend(p[0])
             return p[2]
 
         @self.pg.production('expression : open ( STRING )')
@@ -262,7 +299,7 @@ class Parser:
         @self.pg.production('expression : IDENTIFIER . read ( )')
         def readfile(env, p):
             if type(p[0]) == Open:
-                return Read(Open(p[0].filepath))
+                return Read(p[0])
             else:
                 return Read(Variable(p[0].value))
 
@@ -305,25 +342,114 @@ class Parser:
             return p[4]
 
         @self.pg.production('dict : expression COLON expression')
-        @self.pg.production('dict : expression COLON expression ,')
-        def kwargs_single(state, p):
+        def dict_single(state, p):
             return InnerDict({ p[0]: p[2] })
 
-        @self.pg.production('dict : expression COLON expression , dict')
-        def arglist(state, p):
-            p[4].update(p[0],p[2])
-            return p[4]
+        # Left recursive, so pairs are added in source order.
+        @self.pg.production('dict : dict , expression COLON expression')
+        def dict_pairs(state, p):
+            p[0].update(p[2], p[4])
+            return p[0]
 
+        @self.pg.production('expression : [ ]')
+        @self.pg.production('expression : [ args ]')
+        def expression_array(state, p):
+            return Array(p[1] if len(p) == 3 else InnerArray([]))
+
+        @self.pg.production('expression : { }')
         @self.pg.production('expression : { dict }')
+        @self.pg.production('expression : { dict , }')
         def expression_dict(state, p):
-            return Dict(p[1])
+            return Dict(p[1] if len(p) > 2 else InnerDict())
 
         @self.pg.error
         def error_handler(env, token):
             if token.gettokentype() == "$end":
                 raise SyntaxError("Ran into EoF while still parsing. Check to make sure you have end after every if/def")
-            print(token.getsourcepos())
-            raise ValueError("Ran into a %s where it wasn't expected" % token.gettokentype())
+            message = "Ran into a %s where it wasn't expected" % token.gettokentype()
+            if isinstance(token, Span):
+                message += "\n" + token.source.excerpt(token.start)
+            raise ValueError(message)
+
+    def grammar(self):
+        g = Grammar(self.pg.tokens)
+        for level, (assoc, terms) in enumerate(self.pg.precedence, 1):
+            for term in terms:
+                g.set_precedence(term, assoc, level)
+        for prod_name, syms, func, precedence in self.pg.productions:
+            g.add_production(prod_name, syms, located(func), precedence)
+        g.set_start()
+        return g
+
+    def table_name(self, g):
+        return 'parser-%s-%s.json' % (ParserGenerator.VERSION, self.pg.compute_grammar_hash(g))
+
+    def load_table(self, g):
+        name = self.table_name(g)
+        for directory in (FROZEN_TABLES, cache_dir()):
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if self.pg.data_is_valid(g, data):
+                return LRTable.from_cache(g, data)
+        return None
+
+    def build_table(self, g):
+        g.build_lritems()
+        g.compute_first()
+        g.compute_follow()
+        table = LRTable.from_grammar(g)
+        if table.sr_conflicts:
+            warnings.warn("%d shift/reduce conflicts" % len(table.sr_conflicts), ParserGeneratorWarning)
+        if table.rr_conflicts:
+            warnings.warn("%d reduce/reduce conflicts" % len(table.rr_conflicts), ParserGeneratorWarning)
+        return table
+
+    def save_table(self, g, table, directory):
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with tempfile.NamedTemporaryFile('w', dir=directory, delete=False) as f:
+                json.dump(self.pg.serialize_table(table), f)
+            os.replace(f.name, os.path.join(directory, self.table_name(g)))
+        except OSError:
+            # A read-only cache only costs us the table build next time.
+            pass
 
     def get_parser(self):
-        return self.pg.build()
\ No newline at end of file
+        g = self.grammar()
+        table = self.load_table(g)
+        if table is None:
+            table = self.build_table(g)
+            self.save_table(g, table, cache_dir())
+        return LRParser(table, self.pg.error_handler)
+
+    def freeze(self, directory=FROZEN_TABLES):
+        g = self.grammar()
+        self.save_table(g, self.build_table(g), directory)
+        return os.path.join(directory, self.table_name(g))
+
+def located(func):
+    # Stamps the node a production builds with the position of its first
+    # token, for error messages and the profiler.
+    def production(env, p):
+        node = func(env, p)
+        if isinstance(node, Node) and not node.lineno:
+            for item in p:
+                if isinstance(item, Span):
+                    node.lineno, node.colno = item.lineno, item.colno
+                    break
+                if isinstance(item, Token):
+                    pos = item.getsourcepos()
+                    node.lineno, node.colno = pos.lineno, pos.colno
+                    break
+                if isinstance(item, Node) and item.lineno:
+                    node.lineno, node.colno = item.lineno, item.colno
+                    break
+        return node
+    return production
+
+if __name__ == '__main__':
+    # Writes the tables that mellow.spec bundles into the executable.
+    print(Parser().freeze(*sys.argv[1:]))
\ No newline at end of file
@@ -0,0 +1,191 @@
+from mellowast import *
+import asyncio
+import time
+
+class Stats:
+    __slots__ = ('count', 'inclusive', 'exclusive')
+
+    def __init__(self):
+        self.count = 0
+        self.inclusive = 0.0
+        self.exclusive = 0.0
+
+class Track:
+    # Timings for one kind of key (function name, statement node or node
+    # type). Exclusive time leaves out time spent in nested entries of the
+    # same track; inclusive time is only counted for the outermost entry of
+    # a key, so recursion is not counted twice.
+    def __init__(self):
+        self.stats = {}
+        self.active = {}
+
+    def push(self, stack, key, now):
+        stack.append([key, now, 0.0])
+        self.active[key] = self.active.get(key, 0) + 1
+
+    def pop(self, stack, now):
+        key, start, nested = stack.pop()
+        elapsed = now - start
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = Stats()
+        stats.count += 1
+        stats.exclusive += elapsed - nested
+        self.active[key] -= 1
+        if not self.active[key]:
+            stats.inclusive += elapsed
+        if stack:
+            stack[-1][2] += elapsed
+        return key, elapsed - nested
+
+class TaskState:
+    # What one task is in the middle of: nodes, statements and Mellow
+    # functions being evaluated, and the function names from the root.
+    def __init__(self, root, spawned=False):
+        self.current = []
+        self.nodes = []
+        self.statements = []
+        self.functions = []
+        self.path = [root]
+        # A spawned task's root is timed like a function call around
+        # everything the task evaluates, so its own time gets a stack.
+        self.spawned = spawned
+
+# Times every node the tree walker evaluates, by swapping profiling wrappers
+# in for the eval methods of the node classes between install() and
+# uninstall(). Nothing is changed, and nothing costs, while it is not
+# installed. Each task keeps its own stacks, so spawned work interleaving
+# on the loop is timed correctly.
+class Profiler:
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.functions = Track()
+        self.statements = Track()
+        self.types = Track()
+        self.stacks = {}
+        # Exclusive time per function call chain, for flame graphs.
+        self.collapsed = {}
+        self.statement_ids = set()
+        self.saved = []
+
+    def watch(self, program):
+        # Statements are the direct children of a Program or Block.
+        stack = [program]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, (Program, Block)):
+                self.statement_ids.update(id(s) for s in node.statements)
+            stack.extend(children(node))
+
+    def state(self):
+        task = asyncio.current_task()
+        state = self.stacks.get(task)
+        if state is None:
+            # Spawned Mellow calls are named after their function.
+            if not self.stacks:
+                state = TaskState('<program>')
+            else:
+                state = TaskState('<task %s>' % task.get_name(), True)
+            self.stacks[task] = state
+        return state
+
+    def enter(self, node):
+        state = self.state()
+        if state.current and state.current[-1] is node:
+            # An eval that hands over to the same node's eval_sync.
+            return None
+        now = self.clock()
+        if state.spawned and not state.current:
+            self.functions.push(state.functions, state.path[0], now)
+        state.current.append(node)
+        self.types.push(state.nodes, type(node).__name__, now)
+        if id(node) in self.statement_ids:
+            self.statements.push(state.statements, node, now)
+        if isinstance(node, Function):
+            self.functions.push(state.functions, node.name, now)
+            state.path.append(node.name)
+        return state
+
+    def exit(self, node, state):
+        if state is None:
+            return
+        now = self.clock()
+        state.current.pop()
+        self.types.pop(state.nodes, now)
+        if id(node) in self.statement_ids:
+            self.statements.pop(state.statements, now)
+        if isinstance(node, Function):
+            name, own = self.functions.pop(state.functions, now)
+            key = ';'.join(state.path)
+            self.collapsed[key] = self.collapsed.get(key, 0.0) + own
+            state.path.pop()
+        if state.spawned and not state.current:
+            root, own = self.functions.pop(state.functions, now)
+            self.collapsed[root] = self.collapsed.get(root, 0.0) + own
+
+    def wrap(self, name, method):
+        profiler = self
+        if name == 'eval':
+            async def wrapper(node, env):
+                state = profiler.enter(node)
+                try:
+                    return await method(node, env)
+                finally:
+                    profiler.exit(node, state)
+        else:
+            def wrapper(node, env):
+                state = profiler.enter(node)
+                try:
+                    return method(node, env)
+                finally:
+                    profiler.exit(node, state)
+        wrapper.__name__ = name
+        return wrapper
+
+    def install(self):
+        classes = [Node]
+        while classes:
+            cls = classes.pop()
+            classes.extend(cls.__subclasses__())
+            for name in ('eval', 'eval_sync'):
+                method = cls.__dict__.get(name)
+                if method is not None:
+                    self.saved.append((cls, name, method))
+                    setattr(cls, name, self.wrap(name, method))
+        self.started = self.clock()
+
+    def uninstall(self):
+        self.elapsed = self.clock() - self.started
+        for cls, name, method in self.saved:
+            setattr(cls, name, method)
+        self.saved = []
+        # Top-level time spent outside any Mellow function.
+        outside = self.elapsed - sum(self.collapsed.values())
+        self.collapsed['<program>'] = self.collapsed.get('<program>', 0.0) + max(outside, 0.0)
+
+    def report(self, file, filename='<script>', limit=15):
+        print("profile of %s: %.2f ms" % (filename, self.elapsed * 1000), file=file)
+        sections = [
+            ('functions', self.functions.stats, str, 'inclusive'),
+            ('statements', self.statements.stats, statement_label, 'inclusive'),
+            ('node types', self.types.stats, str, 'exclusive'),
+        ]
+        for title, stats, label, order in sections:
+            rows = sorted(stats.items(), key=lambda item: getattr(item[1], order), reverse=True)
+            print("\n%-36s %9s %12s %12s" % (title + ' (by %s)' % order, 'calls',
+                                             'incl ms', 'excl ms'), file=file)
+            for key, s in rows[:limit]:
+                print("%-36s %9d %12.3f %12.3f" % (label(key)[:36], s.count,
+                                                   s.inclusive * 1000, s.exclusive * 1000), file=file)
+
+    def write_collapsed(self, path):
+        # One "caller;callee value" line per call chain, value in
+        # microseconds, as read by flamegraph.pl, speedscope and inferno.
+        with open(path, 'w') as f:
+            for key, seconds in sorted(self.collapsed.items()):
+                micros = int(round(seconds * 1e6))
+                if micros:
+                    f.write('%s %d\n' % (key, micros))
+
+def statement_label(node):
+    return 'line %d:%d %s' % (node.lineno, node.colno, type(node).__name__)
@@ -0,0 +1,159 @@
+from mellowast import *
+
+class Scope:
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.slots = dict()
+
+    def declare(self, name):
+        if name not in self.slots:
+            self.slots[name] = len(self.slots)
+        return self.slots[name]
+
+# Gives every Variable a (depth, slot) coordinate: depth 0 is the frame of
+# the code it appears in, depth 1 the global frame. Functions are defined
+# globally and do not close over an enclosing function, so a function body
+# only ever sees its own frame and the globals.
+class Resolver:
+    def __init__(self):
+        # Kept across calls, so statements streamed in one at a time share
+        # one global layout that only grows.
+        self.globals = Scope()
+        # Functions resolved so far by name, for the purity check of
+        # memoized functions and the functions they call.
+        self.definitions = {}
+        self.memoized = []
+
+    def resolve_program(self, program):
+        for name in assigned_names(program):
+            self.globals.declare(name)
+        for child in children(program):
+            self.visit(child, self.globals)
+        program.global_names = list(self.globals.slots)
+        memoized, self.memoized = self.memoized, []
+        for node in memoized:
+            reason = impurity(node.function, self.definitions)
+            if reason is not None:
+                raise SyntaxError("line %d: %s cannot be memoized: %s" % (node.lineno, node.name, reason))
+        return program
+
+    def resolve_function(self, node):
+        scope = Scope(self.globals)
+        for param in node.args or []:
+            param.depth, param.slot = 0, scope.declare(param.name)
+        for name in assigned_names(node.function):
+            scope.declare(name)
+        self.visit(node.function, scope)
+        node.nlocals = len(scope.slots)
+        mark_tail(node.function)
+        self.definitions[node.name] = node
+
+    def visit(self, node, scope):
+        if isinstance(node, AssignmentFunction):
+            self.resolve_function(node)
+            return
+        if isinstance(node, Variable):
+            self.bind(node, scope)
+        elif isinstance(node, (ImportedFunction, Await)):
+            node.target = self.target(node.module, scope)
+        elif isinstance(node, GetAttr):
+            node.target = self.target(node.left, scope)
+        elif isinstance(node, DecoratedFunction):
+            node.target = self.target(node.first, scope)
+        elif isinstance(node, Memoize):
+            self.memoized.append(node)
+        for child in children(node):
+            self.visit(child, scope)
+
+    def bind(self, node, scope):
+        if node.name in scope.slots:
+            node.depth, node.slot = 0, scope.slots[node.name]
+        else:
+            # Unknown names become globals that are still undefined, so the
+            # read fails at run time like any other undefined variable.
+            node.slot = self.globals.declare(node.name)
+            node.depth = 0 if scope is self.globals else 1
+
+    def target(self, name, scope):
+        # Receivers like `client` in client.run() may be variables or
+        # imports; only names bound as variables get a slot.
+        if not isinstance(name, str):
+            return None
+        if name in scope.slots or name in self.globals.slots:
+            variable = Variable(name)
+            self.bind(variable, scope)
+            return variable
+        return None
+
+def assigned_names(node):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Assignment) and isinstance(node.left, Variable):
+            yield node.left.name
+        elif isinstance(node, For):
+            yield node.target.name
+        if isinstance(node, (AssignmentFunction, DecoratedFunction)):
+            continue
+        stack.extend(children(node))
+
+# What a memoized function must not do, since a cached call skips it.
+IMPURE = {
+    Print: 'prints',
+    Open: 'opens a file',
+    Read: 'reads a file',
+    Sleep: 'sleeps',
+    Import: 'imports',
+    ImportedFunction: 'calls imported code',
+    GetAttr: 'reads an attribute',
+    Await: 'awaits',
+    AwaitValue: 'awaits',
+    Gather: 'awaits',
+    Spawn: 'spawns a task',
+    Blocking: 'calls imported code',
+    AssignmentFunction: 'defines a function',
+    DecoratedFunction: 'defines a function',
+    Memoize: 'defines a function',
+}
+
+def impurity(function, definitions):
+    # Why the function, or a Mellow function it calls, is not a pure
+    # function of its arguments; None when it is. Callees must already be
+    # defined, so their bodies can be checked too.
+    seen = set()
+    pending = [function]
+    while pending:
+        function = pending.pop()
+        if function.name in seen:
+            continue
+        seen.add(function.name)
+        where = '' if not seen - {function.name} else ' (in %s)' % function.name
+        stack = list(children(function.function))
+        while stack:
+            node = stack.pop()
+            kind = IMPURE.get(type(node))
+            if kind is not None:
+                return "it %s on line %d%s" % (kind, node.lineno, where)
+            if isinstance(node, Variable) and node.depth == 1:
+                return "it uses the global %s%s" % (node.name, where)
+            if isinstance(node, Function):
+                callee = definitions.get(node.name)
+                if callee is None:
+                    return "it calls %s, which is not defined before it%s" % (node.name, where)
+                pending.append(callee)
+            stack.extend(children(node))
+    return None
+
+def mark_tail(node):
+    # A return whose value is the last thing the function evaluates can hand
+    # it back like any other statement value instead of unwinding.
+    if isinstance(node, MemoBody):
+        mark_tail(node.body)
+    elif isinstance(node, Block):
+        mark_tail(node.statements[-1])
+    elif isinstance(node, If):
+        for body in (node.body, node.elif_body, node.else_body):
+            if body is not None:
+                mark_tail(body)
+    elif isinstance(node, Return):
+        node.tail = True
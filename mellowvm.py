@@ -0,0 +1,15 @@
+from mellowast import FunctionReturn
+
+# Runs a program compiled by mellowcompiler. Its statements, and the Mellow
+# functions they call, run as Python functions: a Mellow call is one Python
+# call, so calls nest as deep as Python's recursion limit allows.
+class VM:
+    async def run(self, code, env):
+        try:
+            result = code.function(env)
+            if code.coroutine:
+                result = await result
+        except FunctionReturn as r:
+            # A return among top-level statements left to the tree walker.
+            return r.value
+        return result
@@ -0,0 +1,35 @@
+# Imported by the scripts in test_calls.py.
+
+class Registry:
+    def __init__(self):
+        self.commands = {}
+
+    def command(self, name=None, hidden=False):
+        def register(f):
+            self.commands[name or f.__name__] = (f, hidden)
+            return f
+        return register
+
+    def names(self):
+        return sorted(self.commands)
+
+class Box:
+    def __init__(self):
+        self.fn = self.first
+        self.later = self.first_later
+
+    def first(self):
+        return "first"
+
+    def second(self):
+        return "second"
+
+    async def first_later(self):
+        return "first"
+
+    async def second_later(self):
+        return "second"
+
+    def swap(self):
+        self.fn = self.second
+        self.later = self.second_later
@@ -0,0 +1,25 @@
+import contextlib
+import asyncio
+import sys
+import io
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from mellowloader import Loader
+from mellowenv import Environment
+
+def run(source, engine='ast', optimize=1, cwd=None):
+    # Output of running source as a script, with no .mlwc cache involved.
+    loader = Loader(optimize, cache=False)
+    program = loader.compile_source(source)
+    env = Environment()
+    env.cwd = cwd
+    out = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(out):
+            asyncio.run(loader.run(program, env, engine))
+    finally:
+        env.io.shutdown()
+    return out.getvalue()
@@ -0,0 +1,39 @@
+import mellowcache
+from mellowloader import Loader
+
+SOURCE = 'print(1 + 2)\n'
+
+def test_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setenv('MELLOW_CACHE_DIR', str(tmp_path))
+    path = str(tmp_path / 'script.mlw')
+    program = Loader(1, cache=False).compile_source(SOURCE)
+    assert mellowcache.store(path, SOURCE, 1, program)
+    assert mellowcache.load(path, SOURCE, 1) is not None
+    assert mellowcache.load(path, SOURCE + '\n', 1) is None
+
+def test_changed_tree_modules_invalidate(tmp_path, monkeypatch):
+    monkeypatch.setenv('MELLOW_CACHE_DIR', str(tmp_path))
+    path = str(tmp_path / 'script.mlw')
+    program = Loader(1, cache=False).compile_source(SOURCE)
+    mellowcache.store(path, SOURCE, 1, program)
+    # As if mellowast.py had been edited since the file was written.
+    monkeypatch.setattr(mellowcache, 'magic', mellowcache.get_magic()[:-1] + b'?')
+    assert mellowcache.load(path, SOURCE, 1) is None
+
+def test_unidentified_build_turns_cache_off(tmp_path, monkeypatch):
+    # E.g. a module that cannot be found where it was imported from.
+    monkeypatch.setenv('MELLOW_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(mellowcache, 'magic', None)
+    monkeypatch.setattr(mellowcache, 'TREE_MODULES', ('mellowast', 'no_such_mellow_module'))
+    path = str(tmp_path / 'script.mlw')
+    program = Loader(1, cache=False).compile_source(SOURCE)
+    assert mellowcache.store(path, SOURCE, 1, program) is None
+    assert mellowcache.load(path, SOURCE, 1) is None
+    loader = Loader(1, cache=True)
+    assert loader.load_source(path, SOURCE) is not None
+
+def test_frozen_build_is_the_executable(monkeypatch):
+    monkeypatch.setattr(mellowcache.sys, 'frozen', True, raising=False)
+    frozen = mellowcache.build_id()
+    monkeypatch.setattr(mellowcache, 'TREE_MODULES', ('no_such_mellow_module',))
+    assert mellowcache.build_id() == frozen
@@ -0,0 +1,39 @@
+from conftest import run
+
+ENGINES = ('ast', 'vm')
+
+def test_decorators_with_arguments():
+    source = (
+        'import commands\n'
+        'c = commands.Registry()\n'
+        '@c.command(name = "hi")\n'
+        'def hello():\n'
+        '    print("hello")\n'
+        'end\n'
+        '@c.command("bye" AND hidden = 1)\n'
+        'def goodbye():\n'
+        '    print("goodbye")\n'
+        'end\n'
+        '@c.command()\n'
+        'def plain():\n'
+        '    print("plain")\n'
+        'end\n'
+        'print(c.names())\n'
+    )
+    for engine in ENGINES:
+        assert run(source, engine) == "['bye', 'hi', 'plain']\n"
+
+def test_reassigned_method_is_looked_up_again():
+    source = (
+        'import commands\n'
+        'def show(o):\n'
+        '    print(o.fn())\n'
+        '    print(await o.later())\n'
+        'end\n'
+        'b = commands.Box()\n'
+        'show(b)\n'
+        'b.swap()\n'
+        'show(b)\n'
+    )
+    for engine in ENGINES:
+        assert run(source, engine) == 'first\nfirst\nsecond\nsecond\n'
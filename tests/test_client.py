@@ -0,0 +1,35 @@
+import os
+import pytest
+import mellowclient
+from mellowdaemon import Daemon
+
+def test_default_directory_is_private(tmp_path, monkeypatch):
+    monkeypatch.delenv('MELLOW_SOCKET', raising=False)
+    monkeypatch.delenv('XDG_RUNTIME_DIR', raising=False)
+    monkeypatch.setenv('TMPDIR', str(tmp_path))
+    daemon = Daemon()
+    try:
+        daemon.bind().close()
+    finally:
+        daemon.io.shutdown()
+    directory = os.path.dirname(daemon.address)
+    assert directory == str(tmp_path / ('mellow-%d' % os.getuid()))
+    assert os.stat(directory).st_mode & 0o777 == 0o700
+
+def test_open_directory_is_refused(tmp_path, monkeypatch):
+    monkeypatch.delenv('MELLOW_SOCKET', raising=False)
+    monkeypatch.setenv('XDG_RUNTIME_DIR', str(tmp_path))
+    tmp_path.chmod(0o777)
+    daemon = Daemon()
+    try:
+        with pytest.raises(PermissionError):
+            daemon.bind()
+    finally:
+        daemon.io.shutdown()
+
+def test_socket_of_another_user_is_refused(tmp_path, monkeypatch):
+    address = tmp_path / 'mellow.sock'
+    address.write_text('')
+    monkeypatch.setattr(mellowclient.os, 'getuid', lambda: os.stat(address).st_uid + 1)
+    with pytest.raises(PermissionError):
+        mellowclient.run(source='print(1)\n', address=str(address))
@@ -0,0 +1,177 @@
+import contextlib
+import asyncio
+import glob
+import io
+import os
+import pytest
+from conftest import ROOT, run
+from mellowloader import Loader
+from mellowenv import Environment
+from mellowresolver import Resolver
+from mellowanalysis import StreamAnalysis
+from mellowast import UNDEFINED
+import mellowbench
+
+BENCHMARKS = sorted(glob.glob(os.path.join(ROOT, 'benchmarks', '*.mlw')))
+
+# The tree walker is the reference: the VM has to print exactly what it
+# prints, at both optimisation levels.
+@pytest.mark.parametrize('path', BENCHMARKS, ids=os.path.basename)
+@pytest.mark.parametrize('optimize', [0, 1])
+def test_vm_matches_tree_walker(path, optimize, tmp_path):
+    mellowbench.write_data(str(tmp_path))
+    with open(path) as f:
+        source = f.read()
+    expected = run(source, 'ast', optimize, str(tmp_path))
+    assert expected
+    assert run(source, 'vm', optimize, str(tmp_path)) == expected
+
+def test_optimizer_keeps_output():
+    path = os.path.join(ROOT, 'benchmarks', 'nested.mlw')
+    with open(path) as f:
+        source = f.read()
+    assert run(source, 'ast', 0) == run(source, 'ast', 1)
+
+# Paths the benchmarks do not take: functions that suspend, nodes left to the
+# tree walker inside a compiled function, returns from inside loops, locals
+# read before they are assigned, and extra arguments.
+EDGE_CASES = '''import asyncio
+import builtins
+from math import pi
+def work(n):
+    sleep(0)
+    return n * 2
+end
+def pause(n):
+    x = await asyncio.sleep(0 AND result = n)
+    return x + 1
+end
+def noreturn(x):
+    y = x + 1
+end
+def early(n):
+    i = 0
+    while i < 10:
+        if i == n:
+            return i * 100
+        end
+        i = i + 1
+    end
+    return 0 - 1
+end
+def area(r):
+    if r > 100:
+        pi = 3
+    end
+    return pi * r
+end
+t = spawn work(3)
+print(await t)
+print(gather(spawn work(1), spawn work(2)))
+print(pause(4))
+print(noreturn(1))
+print(early(3))
+print(early(20))
+print(area(2))
+print(noreturn(1, 2, 3))
+total = 0
+for i in builtins.range(4):
+    total = total + work(i)
+end
+print(total)
+'''
+
+@pytest.mark.parametrize('optimize', [0, 1])
+def test_vm_matches_tree_walker_on_edge_cases(optimize):
+    expected = run(EDGE_CASES, 'ast', optimize)
+    assert expected == '6\n[2, 4]\n5\nNone\n300\n-1\n6.283185307179586\nNone\n12\n'
+    assert run(EDGE_CASES, 'vm', optimize) == expected
+
+def stream(source, engine, tmp_path):
+    # Output of running source with --stream, one statement at a time.
+    path = tmp_path / 'stream.mlw'
+    path.write_text(source)
+    loader = Loader(1, cache=False)
+    env = Environment()
+    env.cwd = str(tmp_path)
+    out = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(out):
+            asyncio.run(loader.stream(str(path), env, engine))
+    finally:
+        env.io.shutdown()
+    return out.getvalue()
+
+@pytest.mark.parametrize('path', BENCHMARKS, ids=os.path.basename)
+@pytest.mark.parametrize('engine', ['ast', 'vm'])
+def test_stream_matches_whole_run(path, engine, tmp_path):
+    mellowbench.write_data(str(tmp_path))
+    with open(path) as f:
+        source = f.read()
+    expected = run(source, 'ast', 1, str(tmp_path))
+    assert stream(source, engine, tmp_path) == expected
+
+# twice calls double before double is defined, and f is marked sync against
+# the first g, which the second g (one that suspends) replaces.
+REDEFINED = '''def twice(x):
+    return double(x)
+end
+def double(x):
+    return x * 2
+end
+print(twice(3))
+def g(x):
+    return x
+end
+def f(x):
+    return g(x) + 1
+end
+print(f(1))
+def g(x):
+    sleep(0)
+    return x * 10
+end
+print(f(1))
+def g(x):
+    return x - 1
+end
+print(f(1))
+'''
+
+@pytest.mark.parametrize('engine', ['ast', 'vm'])
+def test_stream_redefinition(engine, tmp_path):
+    expected = '6\n2\n11\n1\n'
+    assert run(REDEFINED, 'ast') == expected
+    assert stream(REDEFINED, engine, tmp_path) == expected
+
+def test_stream_analysis_remarks_callers():
+    loader = Loader(1, cache=False)
+    parser = loader.get_parser()
+    state = Environment()
+    resolver = Resolver()
+    analysis = StreamAnalysis()
+    marked = []
+    for tokens in loader.lexer.statements(REDEFINED, '<script>'):
+        program = parser.parse(iter(tokens), state)
+        resolver.resolve_program(program)
+        analysis.mark(program)
+        marked.append((analysis.remarked, dict(analysis.known)))
+    # The statements: def twice, def double, print, def g, def f, print,
+    # def g, print, def g, print.
+    assert [remarked for remarked, known in marked] == [
+        False, False, False, False, False, False, True, False, True, False]
+    assert marked[1][1] == {'twice': False, 'double': True}
+    assert marked[4][1]['f'] is True
+    assert marked[6][1]['f'] is False and marked[6][1]['g'] is False
+    # g has had several bodies by then, so calls to it stay taken to suspend.
+    assert marked[8][1]['f'] is False
+
+def test_environment_extend_keeps_values():
+    env = Environment().bind(['a'])
+    env.globals[0] = 1
+    env.extend(['a', 'b', 'c'])
+    assert env.names == {'a': 0, 'b': 1, 'c': 2}
+    assert env.globals == [1, UNDEFINED, UNDEFINED]
+    assert env.get('a') == 1 and env.get('b') is None
+    env.extend(['a', 'b', 'c'])
+    assert len(env.globals) == 3
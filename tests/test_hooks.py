@@ -0,0 +1,66 @@
+import asyncio
+import mellowast
+from mellowloader import Loader
+from mellowenv import Environment
+
+SOURCE = '''import builtins
+def size():
+    return builtins.len(open("data.txt").read())
+end
+print(size())
+'''
+
+def test_open_read_keeps_one_trip(tmp_path, monkeypatch, capsys):
+    (tmp_path / 'data.txt').write_text('hello\n')
+    original = mellowast.slurp
+    slurped = []
+    def slurp(path):
+        slurped.append(path)
+        return original(path)
+    monkeypatch.setattr(mellowast, 'slurp', slurp)
+
+    loader = Loader(1, cache=False)
+    program = loader.compile_source(SOURCE)
+    env = Environment()
+    env.cwd = str(tmp_path)
+    awaited = []
+    env.hooks.add('await', lambda node, env: awaited.append(type(node).__name__))
+    try:
+        asyncio.run(loader.run(program, env))
+    finally:
+        env.io.shutdown()
+    assert capsys.readouterr().out == '6\n'
+    assert len(slurped) == 1
+    assert awaited == ['Read']
+
+AWAITED = '''import asyncio
+import time
+def work():
+    await asyncio.sleep(0)
+    x = blocking time.sleep(0)
+    t = spawn blocking time.sleep(0)
+    u = spawn asyncio.sleep(0)
+    return gather(t, u)
+end
+print(work())
+'''
+
+def test_awaited_imported_calls():
+    loader = Loader(1, cache=False)
+    program = loader.compile_source(AWAITED)
+    env = Environment()
+    events = []
+    env.hooks.add('await', lambda node, env: events.append(('await', type(node).__name__)))
+    env.hooks.add('resume', lambda node, value, env: events.append(('resume', type(node).__name__)))
+    env.hooks.add('imported_call', lambda call, f, args, kwargs, env: events.append(('call', f.__name__)))
+    try:
+        asyncio.run(loader.run(program, env))
+    finally:
+        env.io.shutdown()
+    assert events == [
+        ('await', 'Await'), ('call', 'sleep'), ('resume', 'Await'),
+        ('await', 'Blocking'), ('call', 'sleep'), ('resume', 'Blocking'),
+        ('await', 'Spawn'), ('call', 'sleep'), ('resume', 'Spawn'),
+        ('await', 'Spawn'), ('call', 'sleep'), ('resume', 'Spawn'),
+        ('await', 'Gather'), ('resume', 'Gather'),
+    ]
@@ -0,0 +1,42 @@
+import contextvars
+import asyncio
+from mellowio import IOPool
+from conftest import run
+
+request = contextvars.ContextVar('request', default=None)
+
+def test_jobs_see_the_callers_context():
+    pool = IOPool(2)
+    async def main():
+        request.set('first')
+        return await pool.run(request.get)
+    try:
+        assert asyncio.run(main()) == 'first'
+    finally:
+        pool.shutdown()
+
+SOURCE = '''import builtins
+def count():
+    n = 0
+    for line in open("data.txt"):
+        n = n + builtins.len(line)
+    end
+    return n
+end
+print(count())
+'''
+
+def test_file_lines_are_read_on_the_pool(tmp_path, monkeypatch):
+    (tmp_path / 'data.txt').write_text(''.join('line %d\n' % i for i in range(1200)))
+    original = IOPool.submit
+    submitted = []
+    def submit(self, func, *args, **kwargs):
+        submitted.append(func.__name__)
+        return original(self, func, *args, **kwargs)
+    monkeypatch.setattr(IOPool, 'submit', submit)
+    for engine in ('ast', 'vm'):
+        del submitted[:]
+        assert run(SOURCE, engine, cwd=str(tmp_path)) == '9690\n'
+        # Opening, three batches of at most LINE_BATCH lines, and the empty
+        # one at the end.
+        assert submitted == ['File'] + ['batch'] * 4
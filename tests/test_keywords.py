@@ -0,0 +1,43 @@
+from conftest import run
+
+def test_spawn_gather_blocking_as_names():
+    source = (
+        'spawn = 3\n'
+        'gather = [spawn, 4]\n'
+        'blocking = "b"\n'
+        'print(spawn)\n'
+        'print(gather)\n'
+        'print(blocking)\n'
+        'def spawn(n):\n'
+        '    return n + 1\n'
+        'end\n'
+        'print(spawn(1))\n'
+    )
+    for engine in ('ast', 'vm'):
+        assert run(source, engine) == '3\n[3, 4]\nb\n2\n'
+
+def test_spawn_gather_blocking_as_keywords():
+    source = (
+        'import time\n'
+        'def work(n):\n'
+        '    return n + 1\n'
+        'end\n'
+        'def go():\n'
+        '    t = spawn work(1)\n'
+        '    u = spawn blocking time.sleep(0)\n'
+        '    print(gather(t, u))\n'
+        'end\n'
+        'go()\n'
+    )
+    for engine in ('ast', 'vm'):
+        assert run(source, engine) == '[2, None]\n'
+
+def test_user_function_named_gather():
+    source = (
+        'def gather(a, b):\n'
+        '    return a + b\n'
+        'end\n'
+        'print(gather(1, 2))\n'
+    )
+    for engine in ('ast', 'vm'):
+        assert run(source, engine) == '3\n'
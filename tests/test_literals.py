@@ -0,0 +1,105 @@
+from conftest import run
+
+ENGINES = ('ast', 'vm')
+
+def check(source, expected):
+    for engine in ENGINES:
+        for optimize in (0, 1):
+            assert run(source, engine, optimize) == expected, (engine, optimize)
+
+def test_numeric_literals_stay_lists():
+    check(
+        'import json\n'
+        'print(json.dumps([1, 2, 3]))\n'
+        'print([1, 2] + [3, 4, 5])\n'
+        'y = [1, 2]\n'
+        'y.append(3)\n'
+        'print(y)\n',
+        '[1, 2, 3]\n[1, 2, 3, 4, 5]\n[1, 2, 3]\n')
+
+def test_vectors_are_built_explicitly():
+    check(
+        'import mellowarray\n'
+        'v = mellowarray.vector([1, 2, 3])\n'
+        'w = v * 2 + 1\n'
+        'print(w.sum())\n',
+        '15\n')
+
+def test_vector_overflow_matches_without_numpy(monkeypatch):
+    import mellowarray
+    source = (
+        'import mellowarray\n'
+        'v = mellowarray.arange(3) * 3037000500\n'
+        'print(v * 3037000500)\n'
+        'print(v + 1)\n'
+    )
+    expected = '[0.0, 9.22337203700025e+18, 1.84467440740005e+19]\n[1, 3037000501, 6074001001]\n'
+    assert run(source) == expected
+    monkeypatch.setattr(mellowarray, 'numpy', None)
+    monkeypatch.setattr(mellowarray, 'looked_up', True)
+    assert run(source) == expected
+
+def test_index_expressions():
+    check(
+        'x = [10, 20, 30]\n'
+        'i = 1\n'
+        'print(x[i])\n'
+        'print(x[0 + 1])\n'
+        'print(x[2])\n'
+        'def at(xs, n):\n'
+        '    return xs[n + 1]\n'
+        'end\n'
+        'print(at(x, 1))\n'
+        'd = {"a": 1}\n'
+        'print(d["a"])\n',
+        '20\n20\n30\n30\n1\n')
+
+def test_literals_are_new_values_each_time():
+    check(
+        'def grow():\n'
+        '    x = ["a"] + ["b"]\n'
+        '    x.append("c")\n'
+        '    y = [1, 2]\n'
+        '    y.append(3)\n'
+        '    d = {"k": 1}\n'
+        '    d.update({"n": 2})\n'
+        '    return [x, y, d]\n'
+        'end\n'
+        'print(grow())\n'
+        'print(grow())\n',
+        "[['a', 'b', 'c'], [1, 2, 3], {'k': 1, 'n': 2}]\n" * 2)
+
+def test_aliases_see_changes():
+    check(
+        'l = [1, 2]\n'
+        'm = l\n'
+        'm.append(3)\n'
+        'print(l)\n'
+        'x = {"a": [1]}\n'
+        'y = x["a"]\n'
+        'y.append(2)\n'
+        'print(x)\n'
+        'p = {"a": 1}\n'
+        'q = p\n'
+        'q.update({"b": 2})\n'
+        'print(p)\n',
+        "[1, 2, 3]\n{'a': [1, 2]}\n{'a': 1, 'b': 2}\n")
+
+def test_literals_passed_to_python_code():
+    check(
+        'import random\n'
+        'import builtins\n'
+        'def shuffled():\n'
+        '    y = [1, 2, 3, 4, 5, 6, 7, 8]\n'
+        '    random.seed(1)\n'
+        '    random.shuffle(y)\n'
+        '    return y\n'
+        'end\n'
+        'print(shuffled() == shuffled())\n'
+        'print(shuffled() == [1, 2, 3, 4, 5, 6, 7, 8])\n'
+        'nested = [[3, 1, 2], [1]]\n'
+        'random.shuffle(nested)\n'
+        'inner = nested[0]\n'
+        'inner.sort()\n'
+        'print(builtins.len(nested))\n',
+        'True\nFalse\n2\n')
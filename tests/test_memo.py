@@ -0,0 +1,165 @@
+import subprocess
+import contextlib
+import asyncio
+import sys
+import re
+import io
+import os
+import pytest
+from conftest import ROOT
+from mellowloader import Loader
+from mellowenv import Environment
+
+ENGINES = ('ast', 'vm')
+
+def run(source, engine):
+    # Output and the Memo of every memoized function.
+    loader = Loader(1, cache=False)
+    program = loader.compile_source(source)
+    env = Environment()
+    out = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(out):
+            asyncio.run(loader.run(program, env, engine))
+    finally:
+        env.io.shutdown()
+    return out.getvalue(), env.memos
+
+def test_least_recently_used_is_evicted():
+    source = (
+        '@mellow.memoize(maxsize = 2)\n'
+        'def f(n):\n'
+        '    return n * 10\n'
+        'end\n'
+        'f(1)\n'
+        'f(2)\n'
+        'f(1)\n'
+        'f(3)\n'
+        'print(f(2))\n'
+    )
+    for engine in ENGINES:
+        out, memos = run(source, engine)
+        memo = memos['f']
+        assert out == '20\n'
+        # f(1) was used after f(2), so f(2) went first, then f(1).
+        assert list(memo.cache) == [(3,), (2,)]
+        assert memo.stats() == {'hits': 1, 'misses': 4, 'uncached': 0,
+                                'evictions': 2, 'size': 2, 'maxsize': 2}
+
+def test_maxsize_zero_keeps_everything():
+    source = (
+        '@mellow.memoize(maxsize = 0)\n'
+        'def f(n):\n'
+        '    return n + 1\n'
+        'end\n'
+        'for i in [1, 2, 3, 4, 5, 1, 2]:\n'
+        '    f(i)\n'
+        'end\n'
+    )
+    for engine in ENGINES:
+        memo = run(source, engine)[1]['f']
+        assert memo.stats() == {'hits': 2, 'misses': 5, 'uncached': 0,
+                                'evictions': 0, 'size': 5, 'maxsize': 0}
+
+def test_unhashable_arguments_run_uncached():
+    source = (
+        '@mellow.memoize\n'
+        'def first(xs):\n'
+        '    return xs[0]\n'
+        'end\n'
+        'print(first([1, 2]))\n'
+        'print(first([3]))\n'
+        'print(first([3]))\n'
+    )
+    for engine in ENGINES:
+        out, memos = run(source, engine)
+        assert out == '1\n3\n3\n'
+        assert memos['first'].stats() == {'hits': 0, 'misses': 0, 'uncached': 3,
+                                          'evictions': 0, 'size': 0, 'maxsize': 128}
+
+def test_memo_stats_option(tmp_path):
+    script = tmp_path / 'memo.mlw'
+    script.write_text(
+        '@mellow.memoize\n'
+        'def f(n):\n'
+        '    return n\n'
+        'end\n'
+        'f(1)\n'
+        'print(f(1))\n'
+    )
+    env = dict(os.environ, MELLOW_CACHE_DIR=str(tmp_path))
+    done = subprocess.run([sys.executable, os.path.join(ROOT, 'mellow.py'), '--memo-stats', str(script)],
+                          capture_output=True, text=True, env=env, cwd=str(tmp_path))
+    assert done.returncode == 0
+    assert done.stdout == '1\n'
+    # Only the memo line: the parser may warn about its tables too.
+    lines = [line for line in done.stderr.splitlines() if line.startswith('memo ')]
+    assert [line.split() for line in lines] == [
+        ['memo', 'f', 'hits', '1', 'misses', '1', 'uncached', '0',
+         'evictions', '0', 'size', '1', 'maxsize', '128']]
+
+@pytest.mark.parametrize('body, reason', [
+    ('print(n)', 'prints'),
+    ('x = open("a.txt")', 'opens a file'),
+    ('x = open("a.txt").read()', 'reads a file'),
+    ('sleep(1)', 'sleeps'),
+    ('import json', 'imports'),
+    ('x = builtins.len(n)', 'calls imported code'),
+    ('x = builtins.len', 'reads an attribute'),
+    ('await asyncio.sleep(0)', 'awaits'),
+    ('x = await n', 'awaits'),
+    ('x = gather(spawn g(1))', 'awaits'),
+    ('x = spawn g(1)', 'spawns a task'),
+    ('x = blocking builtins.len(n)', 'calls imported code'),
+    ('def h(m):\n        return m\n    end', 'defines a function'),
+    ('@mellow.memoize\n    def h(m):\n        return m\n    end', 'defines a function'),
+    ('x = n + G', 'uses the global G'),
+    ('x = missing(n)', 'calls missing, which is not defined before it'),
+    ('x = g(n)', 'prints on line 6 (in g)'),
+])
+def test_impure_functions_are_rejected(body, reason):
+    source = (
+        'import builtins\n'
+        'import asyncio\n'
+        'import json\n'
+        'G = 1\n'
+        'def g(m):\n'
+        '    print(m)\n'
+        'end\n'
+        '@mellow.memoize\n'
+        'def f(n):\n'
+        '    %s\n'
+        '    return n\n'
+        'end\n'
+    ) % body
+    with pytest.raises(SyntaxError, match=re.escape('f cannot be memoized: it ' + reason)):
+        Loader(1, cache=False).compile_source(source)
+
+def test_engines_agree():
+    # Recursion through the cache, eviction and uncached calls, on the tree
+    # walker and on compiled code.
+    source = (
+        '@mellow.memoize(maxsize = 3)\n'
+        'def fib(n):\n'
+        '    if n < 2:\n'
+        '        return n\n'
+        '    end\n'
+        '    return fib(n - 1) + fib(n - 2)\n'
+        'end\n'
+        '@mellow.memoize\n'
+        'def total(xs, n):\n'
+        '    if n == 0:\n'
+        '        return 0\n'
+        '    end\n'
+        '    return xs[n - 1] + total(xs, n - 1)\n'
+        'end\n'
+        'print(fib(30))\n'
+        'print(fib(10))\n'
+        'print(total([1, 2, 3], 3))\n'
+    )
+    results = []
+    for engine in ENGINES:
+        out, memos = run(source, engine)
+        results.append((out, {name: memo.stats() for name, memo in memos.items()}))
+    assert results[0][0] == '832040\n55\n6\n'
+    assert results[0] == results[1]
@@ -0,0 +1,37 @@
+import asyncio
+from mellowloader import Loader
+from mellowenv import Environment
+from mellowprofile import Profiler
+
+SOURCE = '''def inner(n):
+    return n + 1
+end
+def work(n):
+    i = 0
+    while i < n:
+        i = inner(i)
+    end
+    return i
+end
+def main():
+    t = spawn work(2000)
+    print(gather(t))
+end
+main()
+'''
+
+def test_spawned_tasks_get_a_stack_root(capsys):
+    loader = Loader(1, cache=False)
+    profiler = loader.profiler = Profiler()
+    program = loader.compile_source(SOURCE)
+    env = Environment()
+    profiler.install()
+    try:
+        asyncio.run(loader.run(program, env, 'ast'))
+    finally:
+        profiler.uninstall()
+        env.io.shutdown()
+    assert capsys.readouterr().out == '[2000]\n'
+    assert profiler.collapsed['<task work>'] > 0
+    assert profiler.collapsed['<task work>;inner'] > 0
+    assert '<program>;main' in profiler.collapsed